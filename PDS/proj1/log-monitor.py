@@ -5,12 +5,11 @@ Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
 Date: 4/2024
 """
 import argparse
+import copy
 import json
 
-from src.DataLoader import DataLoader
-from src.FeatureExtraction import FeatureExtraction
-from src.FeatureExtractionModels.TimeWindow import WindowParams
 from src.LogCluster import LogCluster
+from src.Vectorization import extraction_options, load_lines, vectorize
 
 # Mandatory arguments (required by the project specification)
 parser = argparse.ArgumentParser(prog='log-monitor', description='Log monitoring tool')
@@ -25,6 +24,10 @@ parser.add_argument('-c', '--config', type=str, help='Configuration file')
 # Knowledge base import/export
 parser.add_argument('--import_path', type=str, help='Knowledge base file (instead of training file)')
 parser.add_argument('--export_path', type=str, help='Export path for knowledge base')
+parser.add_argument('--update', type=str, help='Log file with new normal behavior to add to imported knowledge base')
+parser.add_argument('--compact', type=float, help='Merge centroids of imported knowledge base closer than given distance')
+parser.add_argument('--workers', type=int, help='Number of scoring processes (overrides configuration)')
+parser.add_argument('--session_workers', type=int, help='Number of processes extracting session ids (overrides configuration)')
 
 def parse_config_file(config_file):
     with open(config_file, 'r') as f:
@@ -45,10 +48,14 @@ def check_valid_args(args):
         print("Can not use training data with import flag")
         print_usage()
     
-    if (args.import_path is not None) and (args.export_path is not None):
+    if (args.import_path is not None) and (args.export_path is not None) and (args.update is None) and (args.compact is None):
         print("Cannot use import and export flags at the same time")
         print_usage()
     
+    if ((args.update is not None) or (args.compact is not None)) and (args.import_path is None):
+        print("Knowledge base must be imported to be updated or compacted")
+        print_usage()
+    
     if (args.training is not None) and (args.config is None):
         print("Configuration file must be provided")
         print_usage()
@@ -77,32 +84,16 @@ def check_valid_config(config):
                 print("Missing mandatory configuration parameters for fixed windowing")
                 exit(1)
             
-def vectorize(config, data, labels):
-    # Load training data
-    x_train, y_train = DataLoader().load_csv(data, labels)
-        
-    if y_train is not None:
-        x_train = x_train[y_train == 0]
-    
-    # Vectorize training data
-    feature_extraction = FeatureExtraction(event_col=config["event_col"])
-    windowing = config["windowing"]
-    
-    # Apply windowing
-    if windowing == "session":
-        x_train, y_train = feature_extraction.session_windowing(x_train, config["session_reg"], config["session_col"], y_train)
-    elif windowing == "sliding":
-        wparams = WindowParams(config["window_size"], config["window_step"], config["time_col"], config["time_fmt"], config["date_col"], config["date_fmt"])
-        x_train, y_train = feature_extraction.sliding_windowing(x_train, wparams, y_train)
-    elif windowing == "fixed":
-        wparams = WindowParams(config["window_size"], 60 * config["window_size"], config["time_col"], config["time_fmt"], config["date_col"], config["date_fmt"])
-        x_train, y_train = feature_extraction.fixed_windowing(x_train, wparams, y_train)
-        
-    # Apply weighting
-    x_train = feature_extraction.apply_weighting(x_train, tf_idf=config["tf_idf"], contrast_w=config["contrast"])
-    
-    return feature_extraction, x_train, y_train
-        
+def model_params(config):
+    # Optional LogCluster parameters, defaults are used when not configured
+    if config is None:
+        return {}
+    params = {}
+    for i in ["block_size", "scoring", "lsh_tables", "lsh_bits", "max_fit_memory_mb", "fit_tmp_dir", "clustering", "workers"]:
+        if i in config:
+            params[i] = config[i]
+    return params
+
 def initialize_model(x_train, y_train, model, fe, export_path):
     # Train the model if no knowledge base is provided
     if y_train is not None:
@@ -113,6 +104,33 @@ def initialize_model(x_train, y_train, model, fe, export_path):
     if export_path is not None:
         model.export_base(export_path, fe)
         
+def update_model(model, fe, data, labels, config, export_path):
+    # Transform new data in the same way as the knowledge base
+    x_update, y_update = load_lines(data, labels, config, fe.input_columns())
+    x_update, y_update = fe.transform(x_update, y_update)
+    if y_update is not None:
+        x_update = x_update[y_update == 0] # Use only normal samples for update
+    
+    # Events of the new data are part of the knowledge base from now on
+    fe.vocabulary.add(x_update.columns)
+    x_update = fe.apply_weighting(x_update, fe.tf_idf, fe.contrast_w)
+    
+    model.partial_fit(x_update)
+    model.export_base(export_path, fe)
+        
+def compact_model(model, fe, eps, export_path):
+    # Merge close centroids and store the smaller knowledge base
+    model.compact(eps)
+    model.export_base(export_path, fe)
+    
+def compaction_report(baseline, model, x_test, y_test):
+    # Compare knowledge base before and after compaction on labeled data
+    print(f"Knowledge base size: {len(baseline.centroids)} -> {len(model.centroids)} centroids")
+    precision_before, recall_before, _ = baseline.evaluate(x_test.copy(), y_test)
+    precision_after, recall_after, _ = model.evaluate(x_test, y_test)
+    print(f"Precision: {precision_before:.3f} -> {precision_after:.3f} ({precision_after - precision_before:+.3f})")
+    print(f"Recall: {recall_before:.3f} -> {recall_after:.3f} ({recall_after - recall_before:+.3f})")
+        
 def session_print_anomalies(anomalies, feature_extraction):
     # Print session ids of anomalies
     for i in anomalies.index.values:
@@ -122,28 +140,40 @@ if __name__ == '__main__':
     # Parse arguments
     args = parser.parse_args()
     check_valid_args(args)
+    config = None
     if args.config is not None:
         config = parse_config_file(args.config)
         check_valid_config(config)
+    if args.workers is not None:
+        config = dict(config or {}, workers=args.workers)
+    if args.session_workers is not None:
+        config = dict(config or {}, session_workers=args.session_workers)
     
     model = None
     
     # Training phase
     if args.import_path is not None:
         # Import knowledge base
-        model = LogCluster()
-        feature_extraction = model.import_base(args.import_path)
+        model = LogCluster(**model_params(config))
+        feature_extraction = model.import_base(args.import_path, **extraction_options(config))
         if args.config != None and config["threshold"] != None:
             model.threshold = config["threshold"]
+        # Add new normal behavior to the knowledge base (overwrite it, unless export path is specified)
+        if args.update is not None:
+            update_model(model, feature_extraction, args.update, args.train_label, config, args.export_path or args.import_path)
+        # Merge close centroids (overwrite the knowledge base, unless export path is specified)
+        if args.compact is not None:
+            baseline = copy.deepcopy(model)
+            compact_model(model, feature_extraction, args.compact, args.export_path or args.import_path)
     else:
         # Otherwise train the model
-        model = LogCluster(max_dist=config["max_dist"], threshold=config["threshold"], contrast_w=config["contrast"])
+        model = LogCluster(max_dist=config["max_dist"], threshold=config["threshold"], contrast_w=config["contrast"], **model_params(config))
         feature_extraction, x_train, y_train = vectorize(config, args.training, args.train_label)
         initialize_model(x_train, y_train, model, feature_extraction, args.export_path)
     
     # Transform testing data
     if args.testing is not None:
-        x_test, y_test = DataLoader().load_csv(args.testing, args.test_label)
+        x_test, y_test = load_lines(args.testing, args.test_label, config, feature_extraction.input_columns())
         x_test, y_test = feature_extraction.transform(x_test, y_test)
         x_test = feature_extraction.apply_weighting(x_test, feature_extraction.tf_idf, feature_extraction.contrast_w)
         if args.test_label is None:
@@ -152,6 +182,8 @@ if __name__ == '__main__':
                 print(anomalies)
             else:
                 session_print_anomalies(anomalies, feature_extraction)
+        elif args.compact is not None:
+            compaction_report(baseline, model, x_test, y_test)
         else:
             model.evaluate(x_test, y_test)
         
\ No newline at end of file
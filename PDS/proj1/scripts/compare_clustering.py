@@ -0,0 +1,46 @@
+"""
+Compare clustering engines of LogCluster (number of clusters, training time, precision and recall)
+
+Usage:
+    python3.10 scripts/compare_clustering.py --training data/HDFS100k/log_structured.csv --train_label data/HDFS100k/log_labels.csv
+        --config config/session_window.json [--engines hierarchical radius leader]
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")) # Adds project directory to python modules path
+
+from src.LogCluster import LogCluster
+from src.Vectorization import vectorize
+
+parser = argparse.ArgumentParser(prog='compare_clustering', description='Compare clustering engines of LogCluster')
+parser.add_argument('--training',    type=str, required=True, help='Training log file')
+parser.add_argument('--train_label', type=str, required=True, help='Training labels file (also used for evaluation)')
+parser.add_argument('-c', '--config', type=str, required=True, help='Configuration file')
+parser.add_argument('--engines', nargs='+', default=["hierarchical", "radius", "leader"], help='Clustering engines to compare')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+
+    _, X, Y = vectorize(config, args.training, args.train_label, normal_only=False, logging=False)
+    print(f"Windows: {X.shape[0]} (normal: {(Y == 0).sum()}, anomalies: {(Y == 1).sum()})")
+    print(f"{'engine':>12} {'clusters':>9} {'fit [s]':>9} {'precision':>10} {'recall':>8} {'F1':>6}")
+
+    for engine in args.engines:
+        model = LogCluster(max_dist=config["max_dist"], threshold=config["threshold"], contrast_w=config["contrast"], logging=False, clustering=engine)
+
+        # Train on normal windows, evaluate on all of them
+        start = time.perf_counter()
+        model.fit(X[Y == 0])
+        fit_time = time.perf_counter() - start
+        precision, recall, f1 = model.evaluate(X, Y)
+
+        print(f"{engine:>12} {len(model.centroids):>9} {fit_time:>9.2f} {precision:>10.3f} {recall:>8.3f} {f1:>6.3f}")
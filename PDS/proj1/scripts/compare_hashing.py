@@ -0,0 +1,50 @@
+"""
+Compare exact event columns with hashed feature spaces of LogCluster (width, collisions, precision and recall)
+
+Usage:
+    python3.10 scripts/compare_hashing.py --training data/HDFS100k/log_structured.csv --train_label data/HDFS100k/log_labels.csv
+        --config config/session_window.json [--buckets 16 64 256 1024]
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+import argparse
+import json
+import os
+import sys
+import zlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")) # Adds project directory to python modules path
+
+from src.LogCluster import LogCluster
+from src.Vectorization import vectorize
+
+parser = argparse.ArgumentParser(prog='compare_hashing', description='Compare exact and hashed event columns of LogCluster')
+parser.add_argument('--training',    type=str, required=True, help='Training log file')
+parser.add_argument('--train_label', type=str, required=True, help='Training labels file (also used for evaluation)')
+parser.add_argument('-c', '--config', type=str, required=True, help='Configuration file')
+parser.add_argument('--buckets', nargs='+', type=int, default=[16, 64, 256, 1024], help='Numbers of hash buckets to compare')
+
+def collisions(events, buckets):
+    """ Number of events sharing their bucket with an other event """
+    hashed = [zlib.crc32(event.encode("utf-8")) % buckets for event in events]
+    return sum(hashed.count(h) > 1 for h in hashed)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+
+    print(f"{'buckets':>8} {'width':>6} {'collisions':>11} {'precision':>10} {'recall':>8} {'F1':>6}")
+    events = None
+    for buckets in [None] + args.buckets:
+        _, X, Y = vectorize({**config, "hash_buckets": buckets}, args.training, args.train_label, normal_only=False, logging=False)
+        if buckets is None:
+            events = X.columns.tolist()
+
+        model = LogCluster(max_dist=config["max_dist"], threshold=config["threshold"], contrast_w=config["contrast"], logging=False)
+        model.fit(X[Y == 0])
+        precision, recall, f1 = model.evaluate(X, Y)
+
+        name, collided = ("exact", 0) if buckets is None else (buckets, collisions(events, buckets))
+        print(f"{name:>8} {X.shape[1]:>6} {collided:>11} {precision:>10.3f} {recall:>8.3f} {f1:>6.3f}")
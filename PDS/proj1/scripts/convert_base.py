@@ -0,0 +1,28 @@
+"""
+Convert pickled knowledge base (exported by older versions of log-monitor) into the binary format
+
+Usage:
+    python3.10 scripts/convert_base.py old_base new_base
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")) # Adds project directory to python modules path
+
+from src.LogCluster import LogCluster
+
+parser = argparse.ArgumentParser(prog='convert_base', description='Convert pickled knowledge base into the binary format')
+parser.add_argument('pickle_path', type=str, help='Pickled knowledge base')
+parser.add_argument('output_path', type=str, help='Path of the converted knowledge base')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    
+    model = LogCluster()
+    feature_extraction = model.import_pickle_base(args.pickle_path)
+    model.export_base(args.output_path, feature_extraction)
+    print(f"Converted {len(model.centroids)} centroids with {len(model.events)} events")
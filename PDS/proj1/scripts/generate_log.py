@@ -0,0 +1,70 @@
+"""
+Generate structured log with sessions over a large vocabulary of events (e.g to measure collisions of hashed event columns)
+
+Usage:
+    python3.10 scripts/generate_log.py --output data/generated/log_structured.csv --labels data/generated/log_labels.csv
+        [--events 2000] [--sessions 5000] [--workflows 500] [--anomalies 0.03] [--seed 0]
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+parser = argparse.ArgumentParser(prog='generate_log', description='Generate structured log with sessions over a large vocabulary')
+parser.add_argument('--output', type=str, required=True, help='Generated structured log file')
+parser.add_argument('--labels', type=str, required=True, help='Generated labels file')
+parser.add_argument('--events', type=int, default=2000, help='Number of events (templates)')
+parser.add_argument('--sessions', type=int, default=5000, help='Number of sessions')
+parser.add_argument('--workflows', type=int, default=500, help='Number of distinct normal sessions (sequences of events)')
+parser.add_argument('--anomalies', type=float, default=0.03, help='Fraction of anomalous sessions')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the generator')
+
+def generate(n_events, n_sessions, n_workflows, anomalies, rng):
+    """ Generate log lines of sessions, normal sessions repeat one of the workflows, anomalous sessions
+    are workflows with one to three additional rare events (rare events never occur in normal sessions)
+
+    ### Returns:
+        x_data (DataFrame): structured log lines (columns of the test data)
+        y_data (DataFrame): label of each line
+    """
+    # Most events are common (used by workflows), the rest only occur in anomalies
+    n_common = max(1, int(0.9 * n_events))
+    popularity = 1 / np.sqrt(np.arange(1, n_common + 1)) # Few frequent events and a long tail of common events
+    popularity /= popularity.sum()
+    workflows = [rng.choice(n_common, size=rng.integers(5, 16), p=popularity) for _ in range(n_workflows)]
+
+    rows, labels = [], []
+    time = pd.Timestamp("2008-11-09 10:00:00")
+    for session in range(n_sessions):
+        events = workflows[rng.integers(n_workflows)]
+        anomaly = rng.random() < anomalies
+        if anomaly:
+            rare = rng.integers(n_common, n_events, size=rng.integers(1, 4))
+            events = np.insert(events, rng.integers(len(events) + 1, size=len(rare)), rare)
+        for event in events:
+            time += pd.Timedelta(seconds=int(rng.integers(0, 3)))
+            if time.hour < 10: # Times are loaded as integers, leading zeros would be lost (e.g 000001 is read as 1)
+                time += pd.Timedelta(hours=10)
+            rows.append((len(rows) + 1, time.strftime("%y%m%d"), time.strftime("%H%M%S"),
+                         f"Event {event + 1} of block blk_{session}", f"E{event + 1}", f"Event {event + 1} of block <*>"))
+            labels.append("Anomaly" if anomaly else "Normal")
+
+    x_data = pd.DataFrame(rows, columns=["Id", "Date", "Time", "Content", "EventId", "EventTemplate"])
+    y_data = pd.DataFrame({"Label": labels})
+    return x_data, y_data
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    assert args.events > 1, "At least two events are required (common and rare)"
+
+    x_data, y_data = generate(args.events, args.sessions, args.workflows, args.anomalies, np.random.default_rng(args.seed))
+    for path in [args.output, args.labels]:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    x_data.to_csv(args.output, index=False)
+    y_data.to_csv(args.labels, index=False)
+    print(f"Generated {x_data.shape[0]} lines of {args.sessions} sessions with {x_data['EventId'].nunique()} distinct events")
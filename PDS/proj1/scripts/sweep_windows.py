@@ -0,0 +1,62 @@
+"""
+Sweep window sizes and steps of time windowing (number of windows, precision and recall of LogCluster)
+
+Usage:
+    python3.10 scripts/sweep_windows.py --training data/HDFS100k/log_structured.csv --train_label data/HDFS100k/log_labels.csv
+        --config config/sliding_window.json --sizes 5 10 30 60 --steps 60 300 1800
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")) # Adds project directory to python modules path
+
+from src.DataLoader import DataLoader
+from src.FeatureExtraction import FeatureExtraction
+from src.FeatureExtractionModels.TimeWindow import WindowParams
+from src.LogCluster import LogCluster
+
+parser = argparse.ArgumentParser(prog='sweep_windows', description='Sweep window sizes and steps of time windowing')
+parser.add_argument('--training',    type=str, required=True, help='Training log file')
+parser.add_argument('--train_label', type=str, required=True, help='Training labels file (also used for evaluation)')
+parser.add_argument('-c', '--config', type=str, required=True, help='Configuration file (time windowing)')
+parser.add_argument('--sizes', nargs='+', type=int, required=True, help='Window sizes in minutes')
+parser.add_argument('--steps', nargs='+', type=int, help='Window steps in seconds (default fixed windows - step equal to size)')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+
+    if args.steps is None:
+        windows = [(size, 60 * size) for size in args.sizes]
+    else:
+        windows = [(size, step) for size in args.sizes for step in args.steps]
+
+    x_data, y_data = DataLoader(False).load_csv(args.training, args.train_label)
+    fe = FeatureExtraction(event_col=config["event_col"], logging=False, sparse=config.get("sparse", False),
+        hash_buckets=config.get("hash_buckets"))
+    wp = WindowParams(None, None, config["time_col"], config["time_fmt"], config["date_col"], config["date_fmt"])
+
+    # The log is parsed once, windows of each configuration are differences of cumulative counts
+    print(f"{'size [m]':>8} {'step [s]':>8} {'windows':>8} {'window [s]':>10} {'precision':>10} {'recall':>8} {'F1':>6}")
+    start = time.perf_counter()
+    for window_wp, X, Y in fe.window_sweep(x_data, wp, windows, y_data):
+        window_time = time.perf_counter() - start
+        if (Y == 0).sum() < 2:
+            print(f"{window_wp.window_size:>8} {window_wp.window_step:>8} {X.shape[0]:>8} {window_time:>10.2f}  not enough normal windows to train")
+            start = time.perf_counter()
+            continue
+
+        X = fe.apply_weighting(X, tf_idf=config["tf_idf"], contrast_w=config["contrast"])
+        model = LogCluster(max_dist=config["max_dist"], threshold=config["threshold"], contrast_w=config["contrast"], logging=False)
+        model.fit(X[Y == 0])
+        precision, recall, f1 = model.evaluate(X, Y)
+
+        print(f"{window_wp.window_size:>8} {window_wp.window_step:>8} {X.shape[0]:>8} {window_time:>10.2f} {precision:>10.3f} {recall:>8.3f} {f1:>6.3f}")
+        start = time.perf_counter()
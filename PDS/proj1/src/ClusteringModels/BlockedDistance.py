@@ -0,0 +1,84 @@
+"""
+Memory capped computation of pairwise cosine distances
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import tempfile
+import numpy as np
+from scipy import sparse
+
+from ..utils import Log, normalize_rows
+
+class BlockedDistance(Log):
+    """ Compute condensed cosine distance matrix (same layout as `scipy.spatial.distance.pdist`) in tiles
+
+    ### Args:
+        max_memory_mb (int): memory budget for the distance matrix and the tiles in megabytes (None = no budget)
+        tmp_dir (str): (optional) directory for the memory mapped distance matrix (default system temp directory)
+        dtype (np.dtype): precision of normalized rows and tiles of similarities (default float32)
+        logging (bool): enable logging
+
+    ### Notes:
+        Rows are L2-normalized in `dtype` and each tile of distances is a single matrix product
+        (sparse samples stay sparse, only the tiles of distances are dense).
+        If the condensed matrix does not fit into the budget, it is written into a temporary
+        memory mapped file, which is removed once the returned array is released.
+    """
+
+    _default_tiles = 2 ** 27 # Memory for tiles (in bytes) without a budget
+
+    def __init__(self, max_memory_mb, tmp_dir = None, dtype = np.float32, logging = True):
+        super().__init__(self.__class__.__name__, logging)
+        self.max_memory = None if max_memory_mb is None else int(max_memory_mb * 1024 ** 2)
+        self.tmp_dir = tmp_dir
+        self.dtype = np.dtype(dtype)
+
+    def pdist(self, X):
+        """ Compute pairwise cosine distances of rows of X
+
+        ### Args:
+            X (np.ndarray | sparse.csr_matrix): samples (one per row)
+
+        ### Returns:
+            p_dist (np.ndarray): condensed distance matrix in float64 (np.memmap if it exceeds the budget)
+        """
+        if sparse.issparse(X):
+            X_norm = normalize_rows(sparse.csr_matrix(X, dtype=self.dtype))[0].astype(self.dtype)
+            x_bytes = X_norm.data.nbytes + X_norm.indices.nbytes + X_norm.indptr.nbytes
+        else:
+            X_norm, _ = normalize_rows(np.asarray(X, dtype=self.dtype))
+            x_bytes = X_norm.nbytes
+        n = X_norm.shape[0]
+        size = n * (n - 1) // 2
+
+        # Keep the distance matrix in memory only if there is still room for tiles
+        budget = self._default_tiles if self.max_memory is None else self.max_memory - x_bytes
+        if self.max_memory is None:
+            p_dist = np.empty(size, dtype=np.float64)
+        elif 8 * size < budget / 2:
+            p_dist = np.empty(size, dtype=np.float64)
+            budget -= p_dist.nbytes
+        else:
+            self.log(f"Distance matrix ({8 * size / 1024 ** 2:.0f} MB) exceeds memory budget, using memory mapped file")
+            with tempfile.TemporaryFile(dir=self.tmp_dir) as file:
+                p_dist = np.memmap(file, dtype=np.float64, mode="w+", shape=(max(size, 1),))[:size]
+
+        # Each row of a tile needs similarities in `dtype` and float64 distances
+        block = int(max(1, budget // ((self.dtype.itemsize + 8) * max(n, 1))))
+        self.log(f"Computing {size} distances in tiles of {block} rows")
+
+        offset = 0
+        for start in range(0, n, block):
+            end = min(start + block, n)
+            sim = X_norm[start:end] @ X_norm[start:].T
+            dist = 1 - (sim.toarray() if sparse.issparse(sim) else sim).astype(np.float64)
+            np.clip(dist, 0, 2, out=dist)
+            # Row i of the condensed matrix contains distances to all rows j > i
+            for i in range(start, end):
+                row = dist[i - start, i - start + 1:]
+                p_dist[offset:offset + row.shape[0]] = row
+                offset += row.shape[0]
+
+        return p_dist
@@ -0,0 +1,77 @@
+"""
+Single pass leader clustering
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import numpy as np
+from scipy import sparse
+
+from ..utils import Log, normalize_rows
+
+class LeaderClustering(Log):
+    """ Assign each sample to the first cluster whose leader is within `max_dist`, otherwise start a new cluster
+
+    ### Args:
+        max_dist (float): maximum cosine distance of a sample to the leader of its cluster
+        block_size (int): number of samples compared with the leaders at once
+        logging (bool): enable logging
+
+    ### Notes:
+        Leader of the cluster is the first sample assigned to it. Unlike complete linkage, two samples
+        of the same cluster may be up to `2 * max_dist` apart and the result depends on the order of samples.
+    """
+
+    def __init__(self, max_dist, block_size = 1024, logging = True):
+        super().__init__(self.__class__.__name__, logging)
+        self.max_dist = max_dist
+        self.block_size = block_size
+
+    def fit_predict(self, X):
+        """ Cluster rows of X in a single pass
+
+        ### Args:
+            X (np.ndarray | sparse.csr_matrix): samples (one per row)
+
+        ### Returns:
+            cluster_index (np.ndarray): cluster of each sample (numbered from 1 in order of creation)
+        """
+        X = sparse.csr_matrix(X, dtype=np.float64) if sparse.issparse(X) else np.asarray(X, dtype=np.float64)
+        X_norm, _ = normalize_rows(X)
+        cluster_index = np.zeros(X_norm.shape[0], dtype=np.int64)
+        leaders = X_norm[:0]
+
+        for start in range(0, X_norm.shape[0], self.block_size):
+            block = X_norm[start:start + self.block_size]
+
+            # Compare the whole block with leaders known before the block
+            first = np.full(block.shape[0], -1, dtype=np.int64)
+            if leaders.shape[0] > 0:
+                close = 1 - self._similarity(block, leaders) <= self.max_dist
+                first = np.where(close.any(axis=1), np.argmax(close, axis=1), -1)
+
+            # Samples without a leader are compared with leaders created within this block
+            new_leaders = []
+            for i in np.flatnonzero(first < 0):
+                if new_leaders:
+                    new_close = 1 - self._similarity(X_norm[new_leaders], block[i:i + 1]).ravel() <= self.max_dist
+                    if new_close.any():
+                        first[i] = leaders.shape[0] + np.argmax(new_close)
+                        continue
+                first[i] = leaders.shape[0] + len(new_leaders)
+                new_leaders.append(start + i)
+
+            if sparse.issparse(X_norm):
+                leaders = sparse.vstack([leaders, X_norm[new_leaders]], format="csr")
+            else:
+                leaders = np.vstack([leaders, X_norm[new_leaders]])
+            cluster_index[start:start + block.shape[0]] = first + 1
+
+        self.log(f"Created {leaders.shape[0]} clusters in a single pass")
+        return cluster_index
+
+    def _similarity(self, A, B):
+        """ Dense matrix of dot products between rows of A and rows of B """
+        sim = A @ B.T
+        return sim.toarray() if sparse.issparse(sim) else sim
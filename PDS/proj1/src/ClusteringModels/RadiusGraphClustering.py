@@ -0,0 +1,146 @@
+"""
+Complete linkage clustering cut at maximum distance computed on a radius neighbor graph
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import heapq
+import numpy as np
+from scipy.sparse import csr_matrix, diags, hstack, issparse
+
+from ..utils import Log, normalize_rows
+
+class RadiusGraphClustering(Log):
+    """ Complete linkage clustering which only considers pairs of samples closer than `max_dist`
+
+    ### Args:
+        max_dist (float): maximum cosine distance to group clusters together
+        block_size (int): number of samples searched for neighbors at once
+        tol (float): values up to `tol` (e.g the noise added in fit) are not indexed
+        noise_norm (float): samples shorter than `noise_norm` are compared with every sample
+        logging (bool): enable logging
+
+    ### Notes:
+        Clusters A and B can only be merged at distance `<= max_dist` if every pair between them is
+        an edge of the neighbor graph. The merged cluster is therefore connected to cluster K only if both
+        A and B were, at distance `max(d(A, K), d(B, K))`. Merging the closest connected pair first gives
+        the same flat clusters as `fcluster(linkage(pdist(X), 'complete'), max_dist, 'distance')`
+        (up to the order of merges with equal distance).
+        Neighbors are searched with an inverted index, so only pairs sharing an event are compared.
+    """
+    _chunk = 2 ** 22 # Maximum number of values gathered at once when computing distances of candidate pairs
+
+    def __init__(self, max_dist, block_size = 1024, tol = 1e-6, noise_norm = 1e-3, logging = True):
+        super().__init__(self.__class__.__name__, logging)
+        self.max_dist = max_dist
+        self.block_size = block_size
+        self.tol = tol
+        self.noise_norm = noise_norm
+
+    def fit_predict(self, X):
+        """ Cluster rows of X
+
+        ### Args:
+            X (np.ndarray | csr_matrix): samples (one per row)
+
+        ### Returns:
+            cluster_index (np.ndarray): cluster of each sample (numbered from 1)
+        """
+        X = csr_matrix(X, dtype=np.float64) if issparse(X) else np.asarray(X, dtype=np.float64)
+        rows, cols, dists = self._neighbor_graph(X)
+        self.log(f"Neighbor graph with {rows.shape[0]} edges within distance {self.max_dist}")
+
+        return self._complete_linkage(X.shape[0], rows, cols, dists)
+
+    def _neighbor_graph(self, X):
+        """ Find all pairs (i < j) of samples with cosine distance at most `max_dist` """
+        X_norm, norms = normalize_rows(X)
+        n = X.shape[0]
+
+        # Samples without indexed events may be close to anything, compare them with all samples
+        support = csr_matrix(abs(X) > self.tol, dtype=np.int32)
+        dense = (np.diff(support.indptr) == 0) | (norms < self.noise_norm)
+        support = diags((~dense).astype(np.int32)) @ support
+
+        # Pairs without a shared indexed event have similarity at most tol * (|x|_1 + |y|_1) / (|x| * |y|)
+        indexed = norms[~dense]
+        l1 = np.asarray(abs(X).sum(axis=1)).ravel()[~dense]
+        bound = 2 * self.tol * np.max(l1 / indexed) / np.min(indexed) if indexed.shape[0] > 0 else 0
+        if 1 - self.max_dist <= bound:
+            self.log(f"Distance {self.max_dist} is too close to 1 for the index, comparing all pairs")
+            dense[:] = True
+
+        # Extra column shared by all samples in `left` but only by dense samples in `right`,
+        # so `left[i] . right[j] > 0` if i and j share an event or j is dense
+        left = hstack([support, csr_matrix(np.ones((n, 1), dtype=np.int32))], format="csr")
+        right = hstack([support, csr_matrix(dense[:, None].astype(np.int32))], format="csr")
+
+        rows, cols, dists = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)]
+        for start in range(0, n, self.block_size):
+            end = min(start + self.block_size, n)
+
+            # Candidates sharing an event or involving a dense sample
+            cand = (left[start:end] @ right.T + right[start:end] @ left.T).tocoo()
+            pair_i, pair_j = cand.row + start, cand.col
+            keep = pair_i < pair_j
+            pair_i, pair_j = pair_i[keep], pair_j[keep]
+
+            # Exact distances of candidate pairs (in chunks of at most `_chunk` values)
+            step = max(1, self._chunk // X.shape[1])
+            for chunk in range(0, pair_i.shape[0], step):
+                i, j = pair_i[chunk:chunk + step], pair_j[chunk:chunk + step]
+                if issparse(X_norm):
+                    sim = np.asarray(X_norm[i].multiply(X_norm[j]).sum(axis=1)).ravel()
+                else:
+                    sim = np.einsum("ij,ij->i", X_norm[i], X_norm[j])
+                dist = np.clip(1 - sim, 0, 2)
+                close = dist <= self.max_dist
+                rows.append(i[close])
+                cols.append(j[close])
+                dists.append(dist[close])
+
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(dists)
+
+    def _complete_linkage(self, n, rows, cols, dists):
+        """ Merge closest pairs of clusters connected in the neighbor graph """
+        # Only pairs of clusters connected by all edges are kept
+        adjacency = [dict() for _ in range(n)]
+        for i, j, d in zip(rows.tolist(), cols.tolist(), dists.tolist()):
+            adjacency[i][j] = d
+            adjacency[j][i] = d
+        heap = list(zip(dists.tolist(), rows.tolist(), cols.tolist()))
+        heapq.heapify(heap)
+
+        parent = np.arange(n)
+        while heap:
+            d, a, b = heapq.heappop(heap)
+            # Skip pairs which were merged or updated since they were pushed
+            if adjacency[a].get(b) != d:
+                continue
+
+            # Merge b into a, the merged cluster stays connected to common neighbors only
+            small, large = sorted([adjacency[a], adjacency[b]], key=len)
+            merged = {k: max(dk, large[k]) for k, dk in small.items() if k in large}
+            for k in adjacency[a]:
+                del adjacency[k][a]
+            for k in adjacency[b]:
+                if k != a:
+                    del adjacency[k][b]
+            merged.pop(a, None)
+            merged.pop(b, None)
+
+            adjacency[a], adjacency[b] = merged, {}
+            for k, dk in merged.items():
+                adjacency[k][a] = dk
+                heapq.heappush(heap, (dk, min(a, k), max(a, k)))
+            parent[b] = a
+
+        # Resolve cluster of each sample and number clusters in order of appearance
+        while True:
+            root = parent[parent]
+            if np.array_equal(root, parent):
+                break
+            parent = root
+        _, first, cluster_index = np.unique(parent, return_index=True, return_inverse=True)
+        return np.argsort(np.argsort(first))[cluster_index] + 1
@@ -5,6 +5,7 @@ Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
 Date: 3/2024
 """
 
+import numpy as np
 import pandas as pd
 from .utils import Log
 
@@ -12,13 +13,15 @@ class DataLoader(Log):
     def __init__(self, logging = True):
         super().__init__(self.__class__.__name__, logging)
         
-    def load_csv(self, data_path, label_path = None, labels_col = "Label"):
+    def load_csv(self, data_path, label_path = None, labels_col = "Label", usecols = None, categorical = None):
         """ Load the structured log data (and labels) from CSV files 
         
         ### Args:
             data_path (str): path to the structured log file
             label_path (str): path to the file with labels (default = None)
             labels_col (str): name of the column with labels in the label file (default = "Label")
+            usecols (list): (optional) columns of the log file to load (default all columns)
+            categorical (list): (optional) columns loaded as categoricals (repeated values are stored only once)
             
         ### Notes:
             The label file must contain only binary values (e.g Normal = 0, Anomaly = 1)
@@ -31,20 +34,60 @@ class DataLoader(Log):
         # Load the structured log data from the file
         self.log(f"Loading data from \"{data_path}\",")
         assert data_path.endswith(".csv"), "Only CSV files are supported"
-        X = pd.read_csv(data_path, engine='c', na_filter=False, memory_map=True, skipinitialspace=True)
+        X = pd.read_csv(data_path, **self._read_options(usecols, categorical))
         Y = None
         
         # If label file is provided, load the labels and merge them with the structured log data
         if label_path is not None:
             self.log(f"Loading labels from \"{label_path}\"") 
             assert label_path.endswith(".csv"), "Only CSV files are supported"
-            Y = pd.read_csv(label_path, engine='c', na_filter=False, memory_map=True, skipinitialspace=True)
+            Y = pd.read_csv(label_path, **self._read_options([labels_col]))
             # Convert labels to binary format and return them as an array
             Y = self._labels_to_binary(Y, labels_col)
             assert X.shape[0] == len(Y), "Number of samples in the data and label files must be the same" 
             
         return X, Y
     
+    def load_csv_chunks(self, data_path, label_path = None, labels_col = "Label", chunk_size = 100000, usecols = None, categorical = None):
+        """ Load the structured log data (and labels) from CSV files in chunks of lines
+        
+        ### Args:
+            data_path (str): path to the structured log file
+            label_path (str): path to the file with labels (default = None)
+            labels_col (str): name of the column with labels in the label file (default = "Label")
+            chunk_size (int): number of lines of a chunk (default = 100000)
+            usecols (list): (optional) columns of the log file to load (default all columns)
+            categorical (list): (optional) columns loaded as categoricals (categories are per chunk)
+            
+        ### Yields:
+            X(DataFrame), Y(Numpy array): consecutive chunks of the log data and their labels (None without labels)
+            
+        ### Notes:
+            Only a single chunk is in memory at a time, so the chunks can be passed to windowing of
+            `FeatureExtraction` instead of the whole log.
+        """
+        self.log(10 * "-" + f" Loading data in chunks of {chunk_size} lines " + 10 * "-")
+        assert data_path.endswith(".csv"), "Only CSV files are supported"
+        assert label_path is None or label_path.endswith(".csv"), "Only CSV files are supported"
+        
+        with pd.read_csv(data_path, chunksize=chunk_size, **self._read_options(usecols, categorical, memory_map=False)) as x_reader:
+            if label_path is None:
+                for X in x_reader:
+                    yield X, None
+                return
+            
+            with pd.read_csv(label_path, chunksize=chunk_size, **self._read_options([labels_col], memory_map=False)) as y_reader:
+                for X in x_reader:
+                    Y = next(y_reader, None)
+                    assert Y is not None and X.shape[0] == len(Y), "Number of samples in the data and label files must be the same"
+                    yield X, self._labels_to_binary(Y, labels_col)
+                assert next(y_reader, None) is None, "Number of samples in the data and label files must be the same"
+    
+    def _read_options(self, usecols = None, categorical = None, memory_map = True):
+        """ Options of `pd.read_csv` shared by all loaders (chunks are read without mapping the whole file into memory) """
+        return {"engine": "c", "na_filter": False, "memory_map": memory_map, "skipinitialspace": True, "usecols": usecols,
+                "dtype": None if categorical is None else {col: "category" for col in categorical}}
+    
     def _labels_to_binary(self, Y_df, labels_col):
         """ Convert labels to binary format (0, 1) 
         
@@ -52,11 +95,10 @@ class DataLoader(Log):
             Y_df (DataFrame): DataFrame with labels
             labels_col (str): name of the column with labels in the DataFrame
         """
-        labels = set(Y_df[labels_col])
-        if labels == {0, 1}: # Already in binary format
+        labels = set(pd.unique(Y_df[labels_col]))
+        if labels <= {0, 1}: # Already in binary format (a chunk may contain only one of the labels)
             return Y_df[labels_col]
-        elif labels == {"Normal", "Anomaly"}: 
-            Y = Y_df[labels_col].apply(lambda x: 0 if x == "Normal" else 1)
-            return Y
+        elif labels <= {"Normal", "Anomaly"}: 
+            return (Y_df[labels_col] == "Anomaly").astype(np.int64)
         else:
             raise ValueError("Only binary labels are supported (0, 1) or (Normal, Anomaly)")
\ No newline at end of file
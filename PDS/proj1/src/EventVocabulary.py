@@ -0,0 +1,89 @@
+"""
+Registry of event ids shared by feature extraction and the knowledge base
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .utils import is_sparse_frame, frame_values, sparse_frame
+
+class EventVocabulary:
+    """ Event ids with stable integer ids (position of the event in the vocabulary)
+
+    ### Args:
+        events (list): (optional) initial events
+
+    ### Notes:
+        New events always get the next free id, so ids of known events never change and matrices
+        aligned to the vocabulary (e.g centroids) only need new columns appended at the end.
+    """
+
+    def __init__(self, events = None):
+        self.events = []
+        self.ids = {}
+        self._index = None # Cached `index` (events are only appended, so its length tells if it is outdated)
+        if events is not None:
+            self.add(events)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __contains__(self, event):
+        return event in self.ids
+
+    def __iter__(self):
+        return iter(self.events)
+
+    @property
+    def index(self):
+        """ Events as pd.Index, rebuilt only after new events are added """
+        if self._index is None or len(self._index) != len(self.events):
+            self._index = pd.Index(self.events)
+        return self._index
+
+    def add(self, events):
+        """ Add unseen events to the end of the vocabulary (in O(new events))
+
+        ### Args:
+            events (list): events to add (known events are skipped)
+
+        ### Returns:
+            added (int): number of added events
+        """
+        size = len(self.events)
+        for event in events:
+            if event not in self.ids:
+                self.ids[event] = len(self.events)
+                self.events.append(event)
+        return len(self.events) - size
+
+    def indexer(self, events):
+        """ Ids of the given events (-1 for unknown events) """
+        return np.fromiter((self.ids.get(event, -1) for event in events), dtype=np.int64, count=len(events))
+
+    def align(self, X):
+        """ Move columns of X to the positions of their events in the vocabulary
+
+        ### Args:
+            X (pd.DataFrame): windows with event ids as columns
+
+        ### Returns:
+            X_aligned (pd.DataFrame): windows with columns in the order of the vocabulary (missing events are zero,
+                events unknown to the vocabulary are dropped), sparse frames stay sparse
+        """
+        ids = self.indexer(X.columns)
+        known = np.flatnonzero(ids >= 0)
+
+        if is_sparse_frame(X):
+            # Selection matrix moves column i of X into column ids[i] of the result
+            select = sparse.csr_matrix((np.ones(known.shape[0]), (known, ids[known])), shape=(X.shape[1], len(self)))
+            return sparse_frame(frame_values(X) @ select, self.events, X.index)
+
+        values = X.values
+        aligned = np.zeros((X.shape[0], len(self)), dtype=np.result_type(values.dtype, np.float64))
+        aligned[:, ids[known]] = values[:, known]
+        return pd.DataFrame(aligned, index=X.index, columns=self.events)
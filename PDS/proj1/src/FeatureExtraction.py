@@ -5,14 +5,17 @@ Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
 Date: 3/2024
 """
 
+import zlib
 import pandas as pd
 import numpy as np
-from collections import Counter
+from itertools import chain
+from scipy import sparse
 from scipy.special import expit
 
-from .utils import Log
-from .FeatureExtractionModels.SessionWindow import SessionBasedExtraction
-from .FeatureExtractionModels.TimeWindow import TimeBasedExtraction
+from .utils import Log, is_sparse_frame, frame_values, sparse_frame
+from .EventVocabulary import EventVocabulary
+from .FeatureExtractionModels.SessionWindow import SessionBasedExtraction, SessionTracker
+from .FeatureExtractionModels.TimeWindow import TimeBasedExtraction, WindowParams
 
 class FeatureExtraction(Log):
     """ Split loaded dataset into windows and extract features from them (vectorization)
@@ -20,17 +23,34 @@ class FeatureExtraction(Log):
     ### Args:
         event_col (str): name of the column containing the event id
         logging (bool): enable logging
+        sparse (bool): store windows in DataFrame with sparse columns (csr matrix with event names as columns)
+        workers (int): number of processes extracting session ids (default 1, independent of the scoring processes
+            of `LogCluster`)
+        max_memory_mb (int): (optional) memory budget of session windowing, events of sessions are spilled to disk
+            and counted in partitions instead of keeping all sessions in memory
+        tmp_dir (str): (optional) directory for the spill files of session windowing (default system temp directory)
+        cache_dir (str): (optional) directory for parsed time and date columns, parsing is skipped for logs parsed before
+        hash_buckets (int): (optional) number of columns of hashed feature space, events are counted in bucket
+            "H" + (crc32 of event id modulo `hash_buckets`) instead of their own column
         
     ### Notes:
         Each event template should be in format E+number -> e.g "E1", "E2", "E3", ...
+        With hashing, the windows always have `hash_buckets` columns (new events never add columns),
+        but events sharing a bucket are indistinguishable.
     """
     
-    def __init__(self, event_col, logging = True):
+    def __init__(self, event_col, logging = True, sparse = False, hash_buckets = None, workers = 1, max_memory_mb = None, tmp_dir = None, cache_dir = None):
         super().__init__(self.__class__.__name__, logging)
         self.event_col = event_col
         self.logging = logging
-        
-        self.events = None
+        self.sparse = sparse
+        self.hash_buckets = hash_buckets
+        self.workers = workers
+        self.max_memory_mb = max_memory_mb
+        self.tmp_dir = tmp_dir
+        self.cache_dir = cache_dir
+        
+        self.vocabulary = None # Events of the training data (see `events`)
         self.extraction = None
         self.extraction_params = None
         
@@ -41,11 +61,29 @@ class FeatureExtraction(Log):
         # Temporary solution to store sessionIDs which are later printed out after anomaly detection
         self.session_ids = None
         
+    @property
+    def events(self):
+        """ List of events of the training data (in order of their ids in `vocabulary`, the list is not copied) """
+        return None if self.vocabulary is None else self.vocabulary.events
+    
+    @events.setter
+    def events(self, events):
+        self.vocabulary = None if events is None else EventVocabulary(events)
+        
+    def __setstate__(self, state):
+        # Feature extraction pickled by older versions (knowledge bases before `KnowledgeBaseFile`) stores the list
+        # of events instead of the vocabulary and has none of the newer options
+        state = dict(state)
+        events = state.pop("events", None)
+        defaults = {"sparse": False, "hash_buckets": None, "workers": 1, "max_memory_mb": None, "tmp_dir": None, "cache_dir": None,
+                    "vocabulary": None if events is None else EventVocabulary(events)}
+        self.__dict__.update({**defaults, **state})
+        
     def session_windowing(self, x_data, session_reg, session_col, y_data = None): 
         """ Split the log sequence into sessions based on session id found in the log message 
         
         ### Args:
-            x_data (DataFrame): raw log lines
+            x_data (DataFrame): raw log lines or consecutive (x_data, y_data) chunks of them (see `DataLoader.load_csv_chunks`)
             session_reg (regex): regular expression to extract session id from log message
             session_col (str): name of the column containing the log message
             y_data (Numpy array): (optional) labels for the raw log lines
@@ -56,18 +94,17 @@ class FeatureExtraction(Log):
         """
         self.log(10 * "-" + f" Extracting Features with session window {session_reg} " + 10 * "-")
         
-        self.extraction = SessionBasedExtraction(logging=self.logging)
+        self.extraction = SessionBasedExtraction(self.logging, self.workers, self.max_memory_mb, self.tmp_dir)
         
         # Count events in each log sequence
-        log_seq_df, Y = self.extraction.transform(x_data, self.event_col, session_reg, session_col, y_data)
-        X_df = self._count_events_in_seq(log_seq_df, self.event_col)
+        X_df, Y, _ = self._count_windows(x_data, y_data, {"session_reg": session_reg, "session_col": session_col})
         
         if y_data is not None: 
             assert X_df.shape[0] == len(Y), "Something went wrong, number of windows does not match the number of labels"
         
         # Store parameters for later use (in transform method)
         self.extraction_params = {"session_reg": session_reg, "session_col": session_col}
-        self.events = X_df.columns.values.tolist()
+        self.events = self._observed_events(X_df)
             
         self._log_statistics(X_df, Y)
         
@@ -77,7 +114,7 @@ class FeatureExtraction(Log):
         """ Split the log sequence into fixed windows based on time and date columns
         
         ### Args:
-            x_data (DataFrame): raw log lines
+            x_data (DataFrame): raw log lines or consecutive (x_data, y_data) chunks of them (see `DataLoader.load_csv_chunks`)
             wp (WindowParams): parameters for windowing
             y_data (Numpy array): (optional) labels for the raw log lines
         
@@ -87,18 +124,17 @@ class FeatureExtraction(Log):
         """
         self.log(10 * "-" + f" Extracting Features with fixed window (size = {wp.window_size}m) " + 10 * "-")
         
-        self.extraction = TimeBasedExtraction(self.logging)
+        self.extraction = TimeBasedExtraction(self.logging, self.cache_dir)
         # window_step == window_size to create non-overlapping windows
         assert wp.window_step == 60 * wp.window_size, "Fixed windowing requires window size to be equal to window step"
-        log_seq_df, Y = self.extraction.transform(x_data, self.event_col, wp, y_data)
         
         # Count events in each log sequence
-        X_df = self._count_events_in_seq(log_seq_df, self.event_col)
+        X_df, Y, _ = self._count_windows(x_data, y_data, {"wp": wp})
         assert X_df.shape[0] == len(Y), "Something went wrong, number of windows does not match the number of labels"
 
         # Store parameters for later use (in transform method)
         self.extraction_params = {"wp": wp}
-        self.events = X_df.columns.values.tolist()
+        self.events = self._observed_events(X_df)
             
         self._log_statistics(X_df, Y)
             
@@ -108,7 +144,7 @@ class FeatureExtraction(Log):
         """ Split the log sequence into sliding windows based on time and date columns
         
         ### Args:
-            x_data (DataFrame): raw log lines
+            x_data (DataFrame): raw log lines or consecutive (x_data, y_data) chunks of them (see `DataLoader.load_csv_chunks`)
             wp (WindowParams): parameters for windowing
             y_data (Numpy array): (optional) labels for the raw log lines
             
@@ -118,29 +154,60 @@ class FeatureExtraction(Log):
         """
         self.log(10 * "-" + f" Extracting Features with sliding window (size = {wp.window_size}m, step = {wp.window_step}s) " + 10 * "-")
         
-        self.extraction = TimeBasedExtraction(self.logging)
-        log_seq_df, Y = self.extraction.transform(x_data, self.event_col, wp, y_data)
+        self.extraction = TimeBasedExtraction(self.logging, self.cache_dir)
         
         # Count events in each log sequence
-        X_df = self._count_events_in_seq(log_seq_df, self.event_col)
+        X_df, Y, _ = self._count_windows(x_data, y_data, {"wp": wp})
         assert X_df.shape[0] == len(Y), "Something went wrong, number of windows does not match the number of labels"
 
         # Store parameters for later use (in transform method)
         self.extraction_params = {"wp": wp}
-        self.events = X_df.columns.values.tolist()
+        self.events = self._observed_events(X_df)
             
         self._log_statistics(X_df, Y)
             
         return X_df, Y
     
+    def window_sweep(self, x_data, wp, windows, y_data = None):
+        """ Split the log sequence into time windows of several sizes and steps, the log is parsed only once
+        
+        ### Args:
+            x_data (DataFrame): raw log lines
+            wp (WindowParams): parameters for windowing (window size and step are taken from `windows`)
+            windows (list): pairs (window_size, window_step) - size in minutes and step in seconds
+            y_data (Numpy array): (optional) labels for the raw log lines
+            
+        ### Yields:
+            wp (WindowParams): parameters of the windows, feature extraction is set to transform data with them
+            X_df (DataFrame): feature matrix with column names as event ids, each row represents a window
+            Y (Array): array containing labels for each window
+        """
+        self.log(10 * "-" + f" Extracting Features with {len(windows)} window configurations " + 10 * "-")
+        
+        self.extraction = TimeBasedExtraction(self.logging, self.cache_dir)
+        codes, code_events = self._encode_events(x_data[self.event_col])
+        cube = self.extraction.count_cube(x_data, self.event_col, len(code_events), wp, y_data, events=codes)
+        
+        for window_size, window_step in windows:
+            window_wp = WindowParams(window_size, window_step, wp.time_col, wp.time_fmt, wp.date_col, wp.date_fmt)
+            _, counts, Y = cube.windows(window_size, window_step)
+            X_df = self._counts_frame(counts, code_events)
+            
+            # Store parameters for later use (in transform method)
+            self.extraction_params = {"wp": window_wp}
+            self.events = self._observed_events(X_df)
+            self._log_statistics(X_df, Y)
+            
+            yield window_wp, X_df, Y
+    
     def transform(self, x_data, y_data = None):
         """ Transform the given log sequence into feature matrix with trained parameters
         This is usefull for transforming testing data to match the configuration of 
         feature extraction for training data (e.g term weighting, contrast based weighting, column names ...)
         
         ### Args:
-            X_df (DataFrame): log sequence
-            Y (Array): (optional) labels for the log sequence
+            X_df (DataFrame): log sequence or consecutive (x_data, y_data) chunks of it (see `DataLoader.load_csv_chunks`)
+            Y (Array): (optional) labels for the log sequence (labels of chunks are part of the chunks)
             
         ### Returns:
             X_df (DataFrame): feature matrix with column names as event ids
@@ -148,24 +215,47 @@ class FeatureExtraction(Log):
         """
         self.log(10 * "-" + " Transforming validation data " + 10 * "-")
         
-        log_seq_df, Y = self.extraction.transform(x_data=x_data, y_data=y_data, event_col=self.event_col, **self.extraction_params)
-        
-        # Store session IDs
-        if "SessionId" in log_seq_df.columns:
-            self.session_ids = log_seq_df["SessionId"].values.tolist()
-        
-        # Count events in each log sequence
-        X_df = self._count_events_in_seq(log_seq_df, self.event_col)
-        
-        # Fill missing events
-        empty_events = set(self.events) - set(X_df.columns)
-        for event in empty_events:
-            X_df[event] = [0] * len(X_df)
+        # Count events in each log sequence and store session IDs
+        X_df, Y, session_ids = self._count_windows(x_data, y_data, self.extraction_params)
+        if session_ids is not None:
+            self.session_ids = session_ids
+        X_df = self._add_missing_events(X_df)
         
         self._log_statistics(X_df, Y)
         
         return X_df, Y
     
+    def session_stream(self, chunks, timeout, max_open_sessions = None):
+        """ Transform a stream of log lines into session windows with trained parameters, sessions are
+        emitted as soon as they are closed (see `SessionTracker`)
+        
+        ### Args:
+            chunks (iterable): consecutive chunks of raw log lines, either DataFrames or (x_data, y_data, times) tuples
+                with optional labels and timestamps of the lines
+            timeout (float): session is closed after `timeout` lines (or seconds, with timestamps) without its log message
+            max_open_sessions (int): (optional) maximum number of open sessions, least recently seen sessions are closed first
+            
+        ### Yields:
+            X_df (DataFrame): feature matrix of closed sessions, their ids are stored in `session_ids`
+            Y (Array): labels of closed sessions (None without labels)
+        """
+        assert isinstance(self.extraction, SessionBasedExtraction), "Stream of sessions requires trained session windowing"
+        tracker = SessionTracker(self.event_col, timeout=timeout, max_open_sessions=max_open_sessions, logging=self.logging,
+                                 workers=self.workers, **self.extraction_params)
+        
+        labeled = False
+        for chunk in chunks:
+            x_data, y_data, times = (chunk, None, None) if isinstance(chunk, pd.DataFrame) else chunk
+            labeled = y_data is not None
+            closed = tracker.update(x_data, y_data, times)
+            if closed[0].shape[0] > 0:
+                yield self._count_closed_sessions(*closed)
+                
+        closed = tracker.flush(labeled)
+        tracker.close()
+        if closed[0].shape[0] > 0:
+            yield self._count_closed_sessions(*closed)
+    
     def split_data(self, X, Y = None, train_ratio = 0.5, split_type = "sequential"):
         """ Split the data into training and validation sets based on the specified split type and ratio
 
@@ -248,10 +338,75 @@ class FeatureExtraction(Log):
         
         return X_df
     
+    def input_columns(self, params = None):
+        """ Columns of raw log lines used by windowing (other columns do not have to be loaded)
+        
+        ### Args:
+            params (dict): (optional) parameters of the extraction (default trained `extraction_params`)
+            
+        ### Returns:
+            usecols (list): columns used by windowing
+            categorical (list): columns with repeated values (event ids, times and dates), which can be loaded as categoricals
+        """
+        params = self.extraction_params if params is None else params
+        if "wp" in params:
+            columns = [self.event_col, params["wp"].time_col] + list(params["wp"].date_col or [])
+            return columns, columns
+        return [self.event_col, params["session_col"]], [self.event_col]
+    
+    def get_params(self):
+        """ Get parameters of the trained feature extraction (stored in the knowledge base)
+        
+        ### Returns:
+            params (dict): JSON serializable parameters, see `from_params`
+        """
+        extraction_params = dict(self.extraction_params or {})
+        if "wp" in extraction_params:
+            extraction_params["wp"] = vars(extraction_params["wp"])
+        
+        return {
+            "event_col": self.event_col,
+            "events": None if self.events is None else list(self.events),
+            "windowing": None if self.extraction is None else "session" if isinstance(self.extraction, SessionBasedExtraction) else "time",
+            "extraction_params": extraction_params,
+            "tf_idf": bool(self.tf_idf),
+            "contrast_w": bool(self.contrast_w),
+            "sparse": bool(self.sparse),
+            "hash_buckets": self.hash_buckets,
+        }
+        
+    @classmethod
+    def from_params(cls, params, logging = True, **options):
+        """ Create feature extraction from parameters returned by `get_params`
+        
+        ### Args:
+            params (dict): parameters of the trained feature extraction
+            logging (bool): enable logging
+            options: runtime options, which are not stored in the parameters (workers, max_memory_mb, tmp_dir, cache_dir)
+        
+        ### Returns:
+            fe (FeatureExtraction): feature extraction ready to transform new data
+        """
+        fe = cls(params["event_col"], logging, params.get("sparse", False), params.get("hash_buckets"), **options)
+        fe.events = params["events"]
+        fe.tf_idf = params["tf_idf"]
+        fe.contrast_w = params["contrast_w"]
+        
+        fe.extraction_params = dict(params["extraction_params"])
+        if params["windowing"] == "session":
+            fe.extraction = SessionBasedExtraction(logging, fe.workers, fe.max_memory_mb, fe.tmp_dir)
+        elif params["windowing"] == "time":
+            fe.extraction = TimeBasedExtraction(logging, fe.cache_dir)
+            fe.extraction_params["wp"] = WindowParams(**fe.extraction_params["wp"])
+        return fe
+    
     def _term_weighting(self, X_df):
         """ Apply tf-idf based weighting based to the given log sequence """
         self.log(f"using term weighting tf-idf")
         
+        if is_sparse_frame(X_df):
+            return self._sparse_term_weighting(X_df)
+        
         N = X_df.shape[0] # Overall number of sequences
         nt = X_df.astype(bool).sum(axis=0) + 1e-8 # Number of sequences containing the term t
         
@@ -263,12 +418,27 @@ class FeatureExtraction(Log):
         
         return idf_df
     
+    def _sparse_term_weighting(self, X_df):
+        """ Apply tf-idf based weighting to the DataFrame with sparse columns (only non-zero values are scaled) """
+        X = frame_values(X_df)
+        nt = np.bincount(X.indices[X.data != 0], minlength=X.shape[1]) + 1e-8 # Number of sequences containing the term t
+        idf_vec = np.nan_to_num(np.log(X.shape[0] / nt))
+        
+        self.tf_idf = True
+        
+        return sparse_frame(X.multiply(idf_vec[None, :]), X_df.columns, X_df.index)
+    
     def _contrast_based_weighting(self, X_df):
         """ Apply contrast based weighting to the given log sequence """
         self.log(f"using contrast based weighting")
         
+        # Every zero count is weighted to 0.25, so the weighted windows are always dense
+        if is_sparse_frame(X_df):
+            self.log(f"contrast based weighting requires dense windows, converting sparse windows")
+            X_df = X_df.sparse.to_dense()
+        
         # Calculate if event occurs in knowledge base
-        contrast_vec = list(map(lambda x: 0.5 * int(x not in self.events), X_df.columns))
+        contrast_vec = list(map(lambda x: 0.5 * int(x not in self.vocabulary), X_df.columns))
         
         # Merge the contraghted dataframe
         X_df = X_df.apply(lambda x: 0.5 * expit(x) + (x > 0) * contrast_vec, axis=1)
@@ -277,30 +447,146 @@ class FeatureExtraction(Log):
         
         return X_df
 
-    def _count_events_in_seq(self, data_df, event_col):
+    def _encode_events(self, events):
+        """ Encode event ids as integer codes (indices into the event ids sorted by their number), only the event
+        column is encoded and the codes are passed to the extraction alongside the raw log lines
+        
+        ### Args:
+            events (Series): event id of each log line
+            
+        ### Returns:
+            codes (np.ndarray): integer code of each log line
+            code_events (np.ndarray): event id of each code
+        """
+        code_events = np.array(sorted(pd.unique(events), key=lambda x: int(x[1:])), dtype=object)
+        codes = pd.Categorical(events, categories=code_events).codes.astype(np.int64)
+        return codes, code_events
+    
+    def _count_windows(self, x_data, y_data, params):
+        """ Split log lines into windows with the current extraction and count events in each window
+        
+        ### Args:
+            x_data (DataFrame): raw log lines or consecutive (x_data, y_data) chunks of them
+            y_data (Array): (optional) labels for the raw log lines
+            params (dict): parameters of the extraction (see `extraction_params`)
+        
+        ### Returns:
+            X_df (DataFrame): count matrix with column names as event ids
+            Y (Array): labels of windows
+            session_ids (list): session id of each window (None for time windows)
+        """
+        if not isinstance(x_data, pd.DataFrame):
+            return self._count_chunks(x_data, params)
+        
+        codes, code_events = self._encode_events(x_data[self.event_col])
+        if isinstance(self.extraction, TimeBasedExtraction):
+            # Time windows are differences of cumulative counts (no lists of events of windows)
+            cube = self.extraction.count_cube(x_data, self.event_col, len(code_events), y_data=y_data, events=codes, **params)
+            _, counts, Y = cube.windows(params["wp"].window_size, params["wp"].window_step)
+            return self._counts_frame(counts, code_events), Y, None
+        
+        if isinstance(self.extraction, SessionBasedExtraction) and self.extraction.max_memory_mb is not None:
+            session_ids, counts, Y = self.extraction.transform_counts(x_data, self.event_col, len(code_events), y_data=y_data, events=codes, **params)
+            return self._counts_frame(counts, code_events), Y, session_ids.tolist()
+        
+        log_seq_df, Y = self.extraction.transform(x_data=x_data, y_data=y_data, event_col=self.event_col, events=codes, **params)
+        session_ids = log_seq_df["SessionId"].values.tolist() if "SessionId" in log_seq_df.columns else None
+        return self._count_events_in_seq(log_seq_df, self.event_col, code_events), Y, session_ids
+    
+    def _count_chunks(self, chunks, params):
+        """ Split log lines read in (x_data, y_data) chunks into windows and count events in each window, only
+        a single chunk of lines is in memory at a time (see `count_cube_chunks` and `transform_chunks`) """
+        vocabulary = EventVocabulary()
+        chunks = self._encode_chunks(chunks, vocabulary)
+        session_ids = None
+        if isinstance(self.extraction, TimeBasedExtraction):
+            cube = self.extraction.count_cube_chunks(chunks, self.event_col, params["wp"])
+            _, counts, Y = cube.windows(params["wp"].window_size, params["wp"].window_step)
+        else:
+            session_ids, counts, Y = self.extraction.transform_chunks(chunks, self.event_col, **params)
+            session_ids = session_ids.tolist()
+        
+        # Codes are ids in order of appearance, columns are sorted by event number as with `_encode_events`
+        counts.resize((counts.shape[0], len(vocabulary)))
+        order = np.argsort([int(event[1:]) for event in vocabulary], kind="stable")
+        return self._counts_frame(counts[:, order], np.array(vocabulary.events, dtype=object)[order]), Y, session_ids
+    
+    def _encode_chunks(self, chunks, vocabulary):
+        """ Encode event ids of each (x_data, y_data) chunk as their ids in `vocabulary` (unseen events are added),
+        (x_data, y_data, ids) chunks are yielded """
+        for x_data, y_data in chunks:
+            codes, uniques = pd.factorize(x_data[self.event_col])
+            vocabulary.add(uniques)
+            yield x_data, y_data, vocabulary.indexer(uniques)[codes]
+    
+    def _count_closed_sessions(self, log_seq_df, Y):
+        """ Count events of sessions closed by `SessionTracker` (lists of event ids) and store their session IDs """
+        lengths = log_seq_df[self.event_col].map(len).to_numpy()
+        codes, code_events = self._encode_events(pd.Series(list(chain.from_iterable(log_seq_df[self.event_col])), dtype=object))
+        
+        log_seq_df = log_seq_df.assign(**{self.event_col: np.split(codes, np.cumsum(lengths)[:-1])})
+        self.session_ids = log_seq_df["SessionId"].values.tolist()
+        return self._add_missing_events(self._count_events_in_seq(log_seq_df, self.event_col, code_events)), Y
+    
+    def _add_missing_events(self, X_df):
+        """ Add columns of training events missing in X_df (in a single step), columns stay sorted by event number """
+        missing = [event for event in self.vocabulary if event not in X_df.columns]
+        if len(missing) > 0:
+            columns = sorted(X_df.columns.tolist() + missing, key=lambda x: int(x[1:]))
+            X_df = EventVocabulary(columns).align(X_df)
+        return X_df
+    
+    def _count_events_in_seq(self, data_df, event_col, code_events):
         """ Count the number of events in given log sequence 
         
         ### Args:
             data_df (DataFrame): log sequence
-            event_col (str): name of the column containing the event id
+            event_col (str): name of the column containing the lists of event codes
+            code_events (np.ndarray): event id of each code (sorted by event id)
         
         ### Returns
             X_df (DataFrame): count matrix with column names as event ids
         """
-        # Create list of ordered dictionaries, each containing the count of each event in a sequence
-        # Source: https://github.com/logpai/loglizer/blob/master/loglizer/preprocessing.py in fit_transform()
-        X_counts = []
-        for i in range(data_df.shape[0]):
-            event_counts = Counter(data_df.loc[i, event_col])
-            X_counts.append(event_counts)
-            
-        # Put the ordered dictionaries into a dataframe and fill in any missing events with 0
-        X_df = pd.DataFrame(X_counts)
-        X_df = X_df.fillna(0)  
+        # Flatten all sequences into pairs (sequence index, event code) and count them in a single sparse matrix
+        sequences = data_df[event_col].to_list()
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+        rows = np.repeat(np.arange(len(sequences)), lengths)
+        codes = np.fromiter(chain.from_iterable(sequences), dtype=np.int64, count=lengths.sum())
+        counts = sparse.csr_matrix((np.ones(codes.shape[0]), (rows, codes)), shape=(len(sequences), len(code_events)))
+        return self._counts_frame(counts, code_events)
+    
+    def _counts_frame(self, counts, code_events):
+        """ Create count matrix with event ids (or hash buckets) as columns from counts of event codes
         
-        # Sort the columns by event id
-        X_df = X_df.reindex(sorted(X_df.columns, key=lambda x: int(x[1:])), axis=1)
-        return X_df
+        ### Args:
+            counts (sparse.csr_matrix): number of occurrences of each event code (column) in each window (row)
+            code_events (np.ndarray): event id of each code (sorted by event id)
+        
+        ### Returns
+            X_df (DataFrame): count matrix with column names as event ids
+        """
+        if self.hash_buckets is not None:
+            # Sum counts of events falling into the same bucket (all buckets are kept)
+            buckets = np.fromiter((zlib.crc32(event.encode("utf-8")) % self.hash_buckets for event in code_events), dtype=np.int64, count=len(code_events))
+            hashing = sparse.csr_matrix((np.ones(len(code_events)), (np.arange(len(code_events)), buckets)), shape=(len(code_events), self.hash_buckets))
+            counts = counts @ hashing
+            columns = [f"H{i}" for i in range(self.hash_buckets)]
+        else:
+            # Keep only events occurring in some sequence (codes are already sorted by event id)
+            used = np.flatnonzero(counts.getnnz(axis=0))
+            counts = counts[:, used]
+            columns = code_events[used].tolist()
+        
+        if self.sparse:
+            return sparse_frame(counts, columns)
+        return pd.DataFrame(counts.toarray(), columns=columns)
+    
+    def _observed_events(self, X_df):
+        """ Events occurring in the windows (empty hash buckets are not part of the training events) """
+        if self.hash_buckets is None:
+            return X_df.columns.values.tolist()
+        used = np.asarray(abs(frame_values(X_df)).sum(axis=0)).ravel() > 0
+        return X_df.columns[used].tolist()
     
     def _log_statistics(self, X_df, Y):
         """ Calculate statistics about the log sequence """
@@ -5,20 +5,61 @@ Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
 Date: 3/2024
 """
 
+import multiprocessing
+import os
+import pickle
+import tempfile
 import pandas as pd
 import numpy as np
 import re
 from collections import OrderedDict
+from scipy import sparse
 
-from ..utils import Log
+from ..utils import Log, align_labels
 
 class SessionBasedExtraction(Log):
-    """ Vectorize the log sequences into sessions based windows based on session id """
+    """ Vectorize the log sequences into sessions based windows based on session id
     
-    def __init__(self, logging = True):
+    ### Args:
+        logging (bool): enable logging
+        workers (int): number of processes extracting session ids (default 1 - no extra processes)
+        max_memory_mb (int): (optional) memory budget of `transform_counts`, sessions are spilled to disk
+        tmp_dir (str): (optional) directory for the spill files (default system temp directory)
+        
+    ### Notes:
+        The pool of worker processes is started by the first extraction and reused by the next ones
+        (e.g every transform or update of `SessionTracker`) until `close` is called.
+    """
+    _line_bytes = 256 # Estimated memory of a single processed line (session id, position, event and label)
+    _spill_partitions = 16 # Initial number of spill files of logs with unknown length
+    _max_spill_depth = 2 # Maximum number of repeated splits of a spill file exceeding the memory budget
+    
+    def __init__(self, logging = True, workers = 1, max_memory_mb = None, tmp_dir = None):
         super().__init__(self.__class__.__name__, logging)
+        self.workers = workers
+        self.max_memory_mb = max_memory_mb
+        self.tmp_dir = tmp_dir
+        self._pool = None # Worker processes extracting session ids (see `_extract_session_ids`)
+    
+    def __getstate__(self):
+        # Worker processes are not copied, the copy starts its own pool
+        return {**self.__dict__, "_pool": None}
+    
+    def __setstate__(self, state):
+        # Extraction pickled by older versions (knowledge bases before `KnowledgeBaseFile`) has no runtime options
+        self.__dict__.update({"workers": 1, "max_memory_mb": None, "tmp_dir": None, **state, "_pool": None})
+    
+    def __del__(self):
+        self.close()
+    
+    def close(self):
+        """ Stop the worker processes extracting session ids """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
         
-    def transform(self, x_data, event_col, session_reg, session_col, y_data = None):
+    def transform(self, x_data, event_col, session_reg, session_col, y_data = None, events = None):
         """ Transform raw logs into session windows
         
         ### Args:
@@ -26,6 +67,7 @@ class SessionBasedExtraction(Log):
             session_reg (str): regular expression to extract session id from log message
             session_col (str): name of the column containing the log message
             y_data (Array): labels for each log message
+            events (np.ndarray): (optional) event of each log message used instead of `event_col` (e.g. integer codes)
             
         ### Returns:
             X_df (DataFrame): feature matrix with column names as event ids, each row represents a session
@@ -36,34 +78,317 @@ class SessionBasedExtraction(Log):
                 and https://github.com/logpai/loglizer/blob/master/loglizer/preprocessing.py
             Authors: LogPAI Team
         """        
-        # Collect all events and labels for each session id
+        # Extract session ids of all log messages at once, each session is counted once per message
         self.log(f"Collecting events")
-        data_dict = OrderedDict()
-        labels_dict = {}
-        for idx, row in x_data.iterrows():
-            blkId_list = re.findall(session_reg, row[session_col])
-            blkId_set = set(blkId_list)
-            # Add the session id to the dictionary
-            for blk_Id in blkId_set:
-                if not blk_Id in data_dict:
-                    data_dict[blk_Id] = []
-                data_dict[blk_Id].append(row[event_col])
-                
-                # Check if the session id has the same label in all logs
-                if y_data is not None:
-                    if not blk_Id in labels_dict:
-                        labels_dict[blk_Id] = y_data[idx]
-                    else:
-                        assert labels_dict[blk_Id] == y_data[idx], "Session id must have the same label in all logs"
-         
-        # Create a dataframe from the list of tuples
-        X_df = pd.DataFrame(list(data_dict.items()), columns=["SessionId", event_col])
-        Y = np.array(list(labels_dict.values()))
+        session_ids = self._extract_session_ids(x_data[session_col], session_reg)
+        rows = session_ids.index.to_numpy()
         
+        # Number sessions in order of first appearance and group their events (stable sort keeps log order)
+        codes, sessions = pd.factorize(session_ids)
+        order = np.argsort(codes, kind="stable")
+        first = np.flatnonzero(np.diff(codes[order], prepend=-1))
+        events = np.split(np.asarray(x_data[event_col] if events is None else events)[rows[order]], first[1:])
+        X_df = pd.DataFrame({"SessionId": sessions.to_numpy(), event_col: events[:len(first)]})
+        
+        Y = None
         if y_data is not None:
+            # Session is labeled by its log messages, all of them must have the same label
+            labels = align_labels(x_data, y_data)[rows[order]]
+            Y = np.maximum.reduceat(labels, first) if len(first) > 0 else labels
+            assert len(first) == 0 or np.array_equal(Y, np.minimum.reduceat(labels, first)), "Session id must have the same label in all logs"
             assert X_df.shape[0] == len(Y), "Number of sessions must match the number of session ids"
-        else:
-            Y = None
         
         return X_df, Y
     
+    def transform_counts(self, x_data, event_col, n_events, session_reg, session_col, y_data = None, events = None):
+        """ Count events in each session without keeping the events of all sessions in memory
+        
+        ### Args:
+            x_data (DataFrame): raw log data with integer event codes in `event_col`
+            event_col (str): name of the column containing event codes
+            n_events (int): number of event codes
+            session_reg (str): regular expression to extract session id from log message
+            session_col (str): name of the column containing the log message
+            y_data (Array): labels for each log message
+            events (np.ndarray): (optional) integer event code of each log message used instead of `event_col`
+            
+        ### Returns:
+            session_ids (np.ndarray): session ids in order of first appearance
+            counts (sparse.csr_matrix): number of occurrences of each event code (column) in each session (row)
+            Y (Array): labels of sessions (None without `y_data`)
+            
+        ### Notes:
+            Lines are processed in chunks, (session id, position, event code, label) of each session id found
+            in the chunk is appended to a spill file chosen by a hash of the session id. Every session is then
+            in a single spill file, so the files are counted one at a time. The number of lines of a chunk and
+            the number of spill files are chosen so that a chunk and an average spill file fit into `max_memory_mb`.
+        """
+        assert self.max_memory_mb is not None, "Memory budget is required to spill sessions to disk"
+        chunk_rows = self._budget_rows()
+        labels = align_labels(x_data, y_data)
+        chunks = ((x_data.iloc[start:start + chunk_rows], None if labels is None else labels[start:start + chunk_rows],
+                   None if events is None else events[start:start + chunk_rows]) for start in range(0, len(x_data), chunk_rows))
+        return self.transform_chunks(chunks, event_col, session_reg, session_col, n_events, max(1, -(-len(x_data) // chunk_rows)))
+    
+    def transform_chunks(self, chunks, event_col, session_reg, session_col, n_events = None, n_partitions = None):
+        """ Count events in each session of a log sequence read in chunks (see `transform_counts`)
+        
+        ### Args:
+            chunks (iterable): consecutive (x_data, y_data, events) chunks of raw log lines with integer event codes
+                of lines in `events` (or in `event_col` if events is None), y_data is None for unlabeled data
+            event_col (str): name of the column containing event codes
+            session_reg (str): regular expression to extract session id from log message
+            session_col (str): name of the column containing the log message
+            n_events (int): (optional) number of event codes (default the largest code found + 1)
+            n_partitions (int): (optional) number of spill files (default `_spill_partitions`)
+            
+        ### Returns:
+            session_ids (np.ndarray): session ids in order of first appearance
+            counts (sparse.csr_matrix): number of occurrences of each event code (column) in each session (row)
+            Y (Array): labels of sessions (None for unlabeled chunks)
+            
+        ### Notes:
+            A spill file with more lines than fit into `max_memory_mb` (or into the largest chunk without
+            a budget) is split again by an other hash of session ids before counting.
+        """
+        n_partitions = n_partitions or self._spill_partitions
+        limit_rows = None if self.max_memory_mb is None else self._budget_rows()
+        partition_rows = np.zeros(n_partitions, dtype=np.int64)
+        labeled, max_code = False, -1
+        
+        with tempfile.TemporaryDirectory(dir=self.tmp_dir) as tmp_dir:
+            paths = [os.path.join(tmp_dir, f"partition_{i}.pkl") for i in range(n_partitions)]
+            self.log(f"Spilling sessions into {n_partitions} partitions")
+            
+            position = 0 # Position of the session id among all found ids (order of appearance)
+            for x_data, y_data, events in chunks:
+                if self.max_memory_mb is None:
+                    limit_rows = max(limit_rows or 1, len(x_data))
+                session_ids = self._extract_session_ids(x_data[session_col], session_reg)
+                rows = session_ids.index.to_numpy()
+                spill = pd.DataFrame({"SessionId": session_ids.to_numpy(), "Position": position + np.arange(len(rows)),
+                                      "Event": np.asarray(x_data[event_col] if events is None else events)[rows]})
+                labeled = y_data is not None
+                if labeled:
+                    spill["Label"] = align_labels(x_data, y_data)[rows]
+                position += len(rows)
+                max_code = max(max_code, spill["Event"].max() if len(rows) > 0 else -1)
+                
+                partition = (pd.util.hash_array(spill["SessionId"].to_numpy()) % n_partitions).astype(np.int64)
+                partition_rows += np.bincount(partition, minlength=n_partitions)
+                self._spill(spill, partition, paths)
+            
+            n_events = max_code + 1 if n_events is None else n_events
+            parts = [part for path, n_rows in zip(paths, partition_rows) if n_rows > 0
+                     for part in self._count_partition(path, n_events, n_rows, limit_rows)]
+        
+        # Sessions of all partitions in order of their first appearance
+        first = np.concatenate([np.zeros(0, dtype=np.int64)] + [part[0] for part in parts])
+        order = np.argsort(first, kind="stable")
+        session_ids = np.concatenate([np.zeros(0, dtype=object)] + [part[1] for part in parts])[order]
+        counts = sparse.vstack([sparse.csr_matrix((0, n_events))] + [part[2] for part in parts], format="csr")[order]
+        Y = None if not labeled else np.concatenate([np.zeros(0, dtype=np.int64)] + [part[3] for part in parts])[order]
+        
+        return session_ids, counts, Y
+    
+    def _budget_rows(self):
+        """ Number of lines fitting into the memory budget """
+        return max(1, int(self.max_memory_mb * 2**20 / self._line_bytes))
+    
+    def _spill(self, spill, partition, paths):
+        """ Append rows of the spill frame to the files of their partitions """
+        for i, part in spill.groupby(partition):
+            with open(paths[i], "ab") as file:
+                pickle.dump(part, file)
+    
+    def _read_spill(self, path):
+        """ Frames stored in a spill file (in order of writing) """
+        with open(path, "rb") as file:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    break
+    
+    def _count_partition(self, path, n_events, n_rows, limit_rows, depth = 0):
+        """ Count events of sessions stored in a spill file
+        
+        ### Returns:
+            parts (list): tuples (first, session_ids, counts, Y) of the file (or of the files it was split into)
+                - first (np.ndarray): position of the first appearance of each session
+                - session_ids (np.ndarray): session ids
+                - counts (sparse.csr_matrix): event counts of each session
+                - Y (np.ndarray): labels of sessions (None for unlabeled data)
+        """
+        if limit_rows is not None and n_rows > limit_rows and depth < self._max_spill_depth:
+            # Split the file by an other hash (the order of lines of each session is kept)
+            n_splits = -(-n_rows // limit_rows)
+            paths = [f"{path}.{i}" for i in range(n_splits)]
+            split_rows = np.zeros(n_splits, dtype=np.int64)
+            for spill in self._read_spill(path):
+                partition = (pd.util.hash_array(spill["SessionId"].to_numpy(), hash_key=f"spill-depth-{depth:04d}") % n_splits).astype(np.int64)
+                split_rows += np.bincount(partition, minlength=n_splits)
+                self._spill(spill, partition, paths)
+            os.remove(path)
+            
+            # All lines in a single file means a single session exceeds the limit, splitting further would not help
+            depth = depth + 1 if split_rows.max() < n_rows else self._max_spill_depth
+            return [part for split_path, rows in zip(paths, split_rows) if rows > 0
+                    for part in self._count_partition(split_path, n_events, rows, limit_rows, depth)]
+        
+        spill = pd.concat(list(self._read_spill(path)), ignore_index=True)
+        
+        # Spill file is in order of positions, so the first row of each session is its first appearance
+        codes, session_ids = pd.factorize(spill["SessionId"])
+        _, first = np.unique(codes, return_index=True)
+        counts = sparse.csr_matrix((np.ones(len(codes)), (codes, spill["Event"].to_numpy())), shape=(len(session_ids), n_events))
+        
+        Y = None
+        if "Label" in spill.columns:
+            labels = spill.groupby(codes)["Label"].agg(["min", "max"])
+            assert (labels["min"] == labels["max"]).all(), "Session id must have the same label in all logs"
+            Y = labels["max"].to_numpy()
+        
+        return [(spill["Position"].to_numpy()[first], session_ids.to_numpy(), counts, Y)]
+    
+    def _extract_session_ids(self, messages, session_reg):
+        """ Find session ids in all log messages with a single compiled regular expression
+        
+        ### Args:
+            messages (Series): log messages
+            session_reg (str): regular expression to extract session id (whole match or its only group)
+            
+        ### Returns:
+            session_ids (Series): session ids indexed by position of their log message (in order of messages,
+                duplicate ids within a message are removed)
+        """
+        pattern = re.compile(session_reg)
+        assert pattern.groups <= 1, "Session regular expression can contain at most one capture group"
+        if pattern.groups == 0:
+            pattern = re.compile(f"({session_reg})")
+        
+        messages = messages.reset_index(drop=True)
+        if self.workers <= 1 or len(messages) < 2 * self.workers:
+            return _find_session_ids(messages, pattern)
+        
+        # Extract ids from consecutive chunks of messages in parallel (chunks are merged in log order)
+        bounds = np.linspace(0, len(messages), self.workers + 1).astype(int)
+        chunks = [(messages.iloc[start:end], pattern) for start, end in zip(bounds[:-1], bounds[1:])]
+        self.log(f"Extracting session ids in {self.workers} processes")
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+        return pd.concat(self._pool.starmap(_find_session_ids, chunks))
+
+def _find_session_ids(messages, pattern):
+    """ Session ids of messages indexed by the index of their message (see `SessionBasedExtraction._extract_session_ids`) """
+    matches = messages.astype(str).str.extractall(pattern)[0]
+    matches.index = matches.index.get_level_values(0)
+    return matches[~pd.DataFrame({"row": matches.index, "id": matches.to_numpy()}).duplicated().to_numpy()]
+
+class SessionTracker(SessionBasedExtraction):
+    """ Incremental session windowing of a log stream, sessions are emitted as soon as they are closed
+    
+    ### Args:
+        event_col (str): name of the column containing the event id
+        session_reg (str): regular expression to extract session id from log message
+        session_col (str): name of the column containing the log message
+        timeout (float): session is closed after `timeout` lines without its log message (or seconds, when
+            timestamps are passed to `update`)
+        max_open_sessions (int): (optional) maximum number of open sessions, least recently seen sessions are closed first
+        logging (bool): enable logging
+        workers (int): number of processes extracting session ids
+        
+    ### Notes:
+        Only open sessions are kept in memory, so the memory does not grow with the length of the log.
+        Log message of a closed session starts a new session with the same id.
+    """
+    
+    def __init__(self, event_col, session_reg, session_col, timeout, max_open_sessions = None, logging = True, workers = 1):
+        super().__init__(logging, workers)
+        self.event_col = event_col
+        self.session_reg = session_reg
+        self.session_col = session_col
+        self.timeout = timeout
+        self.max_open_sessions = max_open_sessions
+        
+        self.sessions = OrderedDict() # Open sessions from least to most recently seen (id -> [events, last seen, labels])
+        self.position = 0 # Number of processed lines
+        
+    def update(self, x_data, y_data = None, times = None):
+        """ Add consecutive log lines to open sessions and close inactive sessions
+        
+        ### Args:
+            x_data (DataFrame): raw log lines following the previously processed lines
+            y_data (Array): (optional) labels for the raw log lines
+            times (Array): (optional) non-decreasing timestamps of the lines in seconds (default line numbers)
+            
+        ### Returns:
+            X_df (DataFrame): closed sessions ("SessionId" and list of events in `event_col`, in order of closing)
+            Y (Array): labels of closed sessions (None without labels)
+        """
+        session_ids = self._extract_session_ids(x_data[self.session_col], self.session_reg)
+        rows = session_ids.index.to_numpy()
+        seen = self.position + np.arange(len(x_data)) if times is None else np.asarray(times, dtype=np.float64)
+        now = seen[-1] if len(x_data) > 0 else (self.position - 1 if times is None else -np.inf)
+        self.position += len(x_data)
+        
+        # Group the lines of each session within the chunk (stable sort keeps log order)
+        codes, sessions = pd.factorize(session_ids)
+        order = np.argsort(codes, kind="stable")
+        first = np.flatnonzero(np.diff(codes[order], prepend=-1))
+        session_rows = np.split(rows[order], first[1:]) if len(rows) > 0 else [] # Chunk may not contain any session id
+        events = np.asarray(x_data[self.event_col])
+        labels = align_labels(x_data, y_data)
+        
+        # Update sessions in order of their last line, so open sessions stay ordered by the last appearance
+        closed = []
+        for i in np.argsort([r[-1] for r in session_rows], kind="stable"):
+            session, r = sessions[i], session_rows[i]
+            state = self.sessions.pop(session, None)
+            
+            # Gaps longer than timeout split the lines into separate sessions (all but the last one are closed)
+            bounds = np.r_[0, np.flatnonzero(np.diff(seen[r]) > self.timeout) + 1, len(r)]
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if state is not None and seen[r[start]] - state[1] > self.timeout:
+                    closed.append((session, state))
+                    state = None
+                state = state or [[], None, set()]
+                state[0].extend(events[r[start:end]])
+                state[1] = seen[r[end - 1]]
+                if labels is not None:
+                    state[2].update(labels[r[start:end]].tolist())
+            self.sessions[session] = state
+            
+        # Close sessions which timed out and least recently seen sessions over the limit
+        while len(self.sessions) > 0:
+            oldest = next(iter(self.sessions.values()))
+            over_limit = self.max_open_sessions is not None and len(self.sessions) > self.max_open_sessions
+            if not over_limit and now - oldest[1] <= self.timeout:
+                break
+            closed.append(self.sessions.popitem(last=False))
+            
+        closed.sort(key=lambda item: item[1][1]) # In order of the last appearance
+        return self._emit(closed, y_data is not None)
+    
+    def flush(self, labeled = False):
+        """ Close all open sessions (e.g at the end of the log)
+        
+        ### Args:
+            labeled (bool): return labels of the sessions (lines were passed with labels)
+            
+        ### Returns:
+            X_df, Y: closed sessions and their labels (see `update`)
+        """
+        closed = list(self.sessions.items())
+        self.sessions.clear()
+        return self._emit(closed, labeled)
+    
+    def _emit(self, closed, labeled):
+        """ Create windows from closed sessions (list of (id, state) pairs) """
+        X_df = pd.DataFrame({"SessionId": [session for session, _ in closed], self.event_col: [state[0] for _, state in closed]})
+        if not labeled:
+            return X_df, None
+        
+        for _, state in closed:
+            assert len(state[2]) == 1, "Session id must have the same label in all logs"
+        return X_df, np.array([next(iter(state[2])) for _, state in closed])
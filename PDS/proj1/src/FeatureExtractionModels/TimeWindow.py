@@ -5,11 +5,14 @@ Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
 Date: 3/2024
 """
 
+import hashlib
+import os
+import tempfile
 import pandas as pd
 import numpy as np
-from collections import OrderedDict
+from scipy import sparse
 
-from ..utils import Log
+from ..utils import Log, align_labels
 
 class WindowParams:
     """ Parameters for windowing 
@@ -31,12 +34,19 @@ class WindowParams:
         self.date_fmt = date_fmt
         
 class TimeBasedExtraction(Log):
-    """ Vectorize the log sequences into time based windows """
-    _new_date_col = "_Date_" # Name of the internal date column used for windowing based on date
-    _new_rows_col = "_Rows_" # Name of the internal rows column used for windowing based on date
+    """ Vectorize the log sequences into time based windows
     
-    def __init__(self, logging = True):
+    ### Args:
+        logging (bool): enable logging
+        cache_dir (str): (optional) directory with parsed time and date columns of previously processed logs
+    """
+    def __init__(self, logging = True, cache_dir = None):
         super().__init__(self.__class__.__name__, logging)
+        self.cache_dir = cache_dir
+        
+    def __setstate__(self, state):
+        # Extraction pickled by older versions (knowledge bases before `KnowledgeBaseFile`) has no runtime options
+        self.__dict__.update({"cache_dir": None, **state})
         
     def transform(self, x_data, event_col, wp, y_data = None):
         """ Transform raw logs into windows of size `window_size` and step `window_step`
@@ -58,90 +68,283 @@ class TimeBasedExtraction(Log):
             X_df (DataFrame): feature matrix with column names as event ids, each row represents a sliding window
             Y_df (Numpy array): label matrix with column "Label" column containing labels for sliding windows
         """
-        x_data, unique_dates = self._str_to_datetimes(x_data, wp.time_col, wp.time_fmt, wp.date_col, wp.date_fmt)
-        
-        # If dates are provided, create windows for each date
-        if unique_dates is not None:
-            self.log(f"Dates found: {[x.date() for x in map(pd.to_datetime, unique_dates)]}")
-            X_df = pd.DataFrame()
-            for date in unique_dates:
-                self.log(f"Creating windows for date {pd.to_datetime(date).date()}")
-                # Get the events for the given date
-                date_events = x_data[x_data[self._new_date_col] == date]
-                # Create the windows for the given date
-                date_windows = self._create_windows(date_events, wp.window_size, wp.time_col, wp.window_step, event_col)
-                X_df = pd.concat([X_df, date_windows], ignore_index=True)
-        else:
-            # Otherwise create windows for the whole sequence
-            X_df = self._create_windows(x_data, wp.window_size, wp.time_col, wp.window_step, event_col)
+        # If dates are provided, windows are created for each date (all dates at once)
+        times, dates = self._str_to_datetimes(x_data, wp.time_col, wp.time_fmt, wp.date_col, wp.date_fmt)
+        date_codes = self._date_codes(dates)
+        
+        # Cube with a single column counting lines gives the range of sorted lines of each window
+        lines = sparse.csr_matrix(np.ones((len(times), 1), dtype=np.int32))
+        anomalies = None if y_data is None else (align_labels(x_data, y_data) == 1).astype(np.int64)
+        cube = EventCountCube(times, lines, date_codes, anomalies)
+        starts, lo, hi = cube.bounds(wp.window_size, wp.window_step)
+        self.log(f"Created {len(starts)} windows for {cube.n_dates} dates")
+        
+        # Windows are views into the events sorted by (date, time) in the same way as rows of the cube
+        order = np.lexsort((times, np.zeros(len(times), dtype=np.int64) if date_codes is None else date_codes))
+        events, line_lo, line_hi = np.asarray(x_data[event_col])[order], cube.cumulative(lo)[:, 0], cube.cumulative(hi)[:, 0]
+        X_df = pd.DataFrame({"Time": pd.to_datetime(starts), event_col: [events[l:h] for l, h in zip(line_lo, line_hi)]})
+        return X_df, cube.labels(lo, hi)
+        
+    def count_cube(self, x_data, event_col, n_events, wp, y_data = None, events = None):
+        """ Parse the log sequence once into cumulative event counts, which give windows of any size and step
+        
+        ### Args:
+            x_data (DataFrame): log sequence with integer event codes in `event_col`
+            event_col (str): name of the column containing the event codes
+            n_events (int): number of event codes
+            wp (WindowParams): parameters for windowing (only time and date columns and formats are used)
+            y_data (Numpy array): (optional) labels for the log sequence
+            events (np.ndarray): (optional) integer event code of each line used instead of `event_col`
             
-        # Split the data
-        if y_data is not None:
-            Y = self._split_labels(X_df, y_data)
-        else:
-            Y = None
+        ### Returns:
+            cube (EventCountCube): cumulative event counts, see `EventCountCube.windows`
+        """
+        times, dates = self._str_to_datetimes(x_data, wp.time_col, wp.time_fmt, wp.date_col, wp.date_fmt)
+        date_codes = self._date_codes(dates)
         
-        return X_df, Y
+        codes = np.asarray(x_data[event_col] if events is None else events)
+        counts = sparse.csr_matrix((np.ones(len(codes), dtype=np.int32), (np.arange(len(codes)), codes)), shape=(len(codes), n_events))
+        anomalies = None if y_data is None else (align_labels(x_data, y_data) == 1).astype(np.int64)
+        return EventCountCube(times, counts, date_codes, anomalies)
+    
+    def count_cube_chunks(self, chunks, event_col, wp, n_events = None):
+        """ Build cumulative event counts from consecutive chunks of the log sequence, only counts of unique
+        timestamps of each chunk are kept in memory (not the lines)
         
+        ### Args:
+            chunks (iterable): consecutive (x_data, y_data, events) chunks of the log sequence with integer event
+                codes of lines in `events` (or in `event_col` if events is None), y_data is None for unlabeled data
+            event_col (str): name of the column containing the event codes
+            wp (WindowParams): parameters for windowing (only time and date columns and formats are used)
+            n_events (int): (optional) number of event codes (default the largest code found + 1)
+            
+        ### Returns:
+            cube (EventCountCube): cumulative event counts, see `EventCountCube.windows`
+        """
+        parts = []
+        for x_data, y_data, events in chunks:
+            times, dates = self._str_to_datetimes(x_data, wp.time_col, wp.time_fmt, wp.date_col, wp.date_fmt)
+            dates = np.zeros(len(times), dtype=np.int64) if dates is None else dates
+            
+            # Dates are numbered in order of appearance within the chunk, so merged timestamps keep that order
+            date_codes, date_values = pd.factorize(dates)
+            codes = np.asarray(x_data[event_col] if events is None else events)
+            counts = sparse.csr_matrix((np.ones(len(codes), dtype=np.int32), (np.arange(len(codes)), codes)),
+                                       shape=(len(codes), codes.max() + 1 if len(codes) > 0 else 0))
+            anomalies = None if y_data is None else (align_labels(x_data, y_data) == 1).astype(np.int64)
+            times, date_codes, counts, anomalies = _merge_timestamps(times, date_codes, counts, anomalies)
+            parts.append((times, date_values[date_codes], counts, anomalies))
+        
+        n_events = max([n_events or 0] + [part[2].shape[1] for part in parts])
+        for _, _, counts, _ in parts:
+            counts.resize((counts.shape[0], n_events))
+        
+        dates = np.concatenate([np.zeros(0, dtype=np.int64)] + [part[1] for part in parts])
+        date_codes, date_values = pd.factorize(dates)
+        if wp.date_col is not None:
+            self.log(f"Dates found: {[x.date() for x in pd.to_datetime(date_values)]}")
+        
+        times = np.concatenate([np.zeros(0, dtype=np.int64)] + [part[0] for part in parts])
+        counts = sparse.vstack([sparse.csr_matrix((0, n_events), dtype=np.int32)] + [part[2] for part in parts], format="csr")
+        labeled = len(parts) > 0 and parts[0][3] is not None
+        anomalies = np.concatenate([part[3] for part in parts]) if labeled else None
+        return EventCountCube(times, counts, date_codes, anomalies)
+    
     def _str_to_datetimes(self, x_data, time_col, time_format_str, date_col, date_col_format):
-        """ Convert time and date columns into datetime using the specified formats """
-        # Convert time into datetime
-        x_data[time_col] = pd.to_datetime(x_data[time_col], format=time_format_str)
-        unique_dates = None
+        """ Convert time and date columns using the specified formats (see `_parse_datetimes`), log lines are not modified
         
-        # Convert date into datetime if specified
+        ### Returns:
+            times (np.ndarray): time of each line (int64 nanoseconds)
+            dates (np.ndarray): date of each line (int64 nanoseconds, None without date columns)
+        """
         if date_col is not None:
             assert date_col_format is not None, "Date column format must be specified"
-            # Date specified in single column
-            if len(date_col) == 1:
-                x_data[self._new_date_col] = pd.to_datetime(x_data[date_col[0]], format=date_col_format)
-            else: # Date specified in multiple columns
-                # Merge the date columns into a new single column
-                x_data[self._new_date_col] = x_data[date_col].apply(lambda x: "".join(x), axis=1)
-                x_data[self._new_date_col] = pd.to_datetime(x_data[self._new_date_col], format=date_col_format)
-            # Get all the unique dates
-            unique_dates = pd.unique(x_data[self._new_date_col])
-            
-        return x_data, unique_dates
-        
-    def _create_windows(self, x_data, window_size, window_col, window_step, event_col):
-        """ Create windows of `window_size`, repeating every `window_step` for the given log sequence based on time """
-        start_time = x_data[window_col].min()
-        end_time = x_data[window_col].max()
-        eventIds = OrderedDict()
-        
-        self.log(f"Window range from {start_time.time()} to {end_time.time()}")
-        
-        for window_start in pd.date_range(start=start_time, end=end_time, freq=f"{window_step}s"):
-            self.log(f"Creating window for {window_start.time()}")
-            window_end = window_start + pd.Timedelta(minutes=window_size)
-            window = x_data[(x_data[window_col] >= window_start) & (x_data[window_col] < window_end)]
-            # Make sure to keep the rows as well, so we can use them for splitting labels
-            eventIds[window_start] = (window[event_col].to_list(), window.index.to_list())
-        
-        # Turn the dictionary into a list of tuples so we can create a dataframe from it
-        events = [(time, events, rows) for time, (events, rows) in eventIds.items()]
-        
-        # Merge the event counts into a dataframe
-        X_df = pd.DataFrame(events, columns=["Time", event_col, self._new_rows_col])
-        
-        return X_df
-    
-    def _split_labels(self, X_df, y_data):
-        # Split the labels based on rows if specified
-        if y_data is not None:
-            labels_dict = {}
-            label_row = 0
-            y_data = np.array(y_data)
-            for rows in X_df[self._new_rows_col]:
-                # If at least one label is "Anomaly", the whole window is labeled as "Anomaly"
-                if 1 in y_data[rows]:
-                    labels_dict[label_row] = 1
-                else:
-                    labels_dict[label_row] = 0
-                label_row += 1
-            # Create array from the dictionary
-            y_data = list(labels_dict.values())
+        
+        times, dates = self._cached(x_data, time_col, time_format_str, date_col, date_col_format)
+        times = np.asarray(times, dtype="datetime64[ns]").astype(np.int64)
+        return times, None if dates is None else np.asarray(dates, dtype="datetime64[ns]").astype(np.int64)
+    
+    def _date_codes(self, dates):
+        """ Number dates of lines in order of their first appearance (None without date columns) """
+        if dates is None:
+            return None
+        date_codes, unique_dates = pd.factorize(dates)
+        self.log(f"Dates found: {[x.date() for x in pd.to_datetime(unique_dates)]}")
+        return date_codes
+    
+    def _cached(self, x_data, time_col, time_format_str, date_col, date_col_format):
+        """ Parse time and date columns, parsed values are stored in `cache_dir` (if set) under a hash of the raw values
+        and formats, so parsing of the same log is skipped in the next runs """
+        if self.cache_dir is None:
+            return self._parse_datetimes(x_data, time_col, time_format_str, date_col, date_col_format)
+        
+        columns = [time_col] + list(date_col or [])
+        digest = hashlib.blake2b(pd.util.hash_pandas_object(x_data[columns], index=False).to_numpy().tobytes(), digest_size=16)
+        digest.update(repr((time_format_str, date_col_format, len(columns))).encode("utf-8"))
+        path = os.path.join(self.cache_dir, f"datetimes_{digest.hexdigest()}.npz")
+        
+        if os.path.exists(path):
+            self.log(f"Using parsed datetimes from {path}")
+            with np.load(path) as cached:
+                return cached["times"], cached["dates"] if "dates" in cached else None
+        
+        times, dates = self._parse_datetimes(x_data, time_col, time_format_str, date_col, date_col_format)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".npz", delete=False) as file:
+            np.savez(file, times=times, **({} if dates is None else {"dates": dates}))
+        os.replace(file.name, path)
+        return times, dates
+    
+    def _parse_datetimes(self, x_data, time_col, time_format_str, date_col, date_col_format):
+        """ Convert time and date columns into datetime64 arrays, each unique value (or unique combination of
+        date columns) is parsed only once and the result is broadcast back to the lines by their codes """
+        times = self._parse_unique(*self._factorize(x_data[time_col]), time_format_str)
+        if date_col is None:
+            return times, None
+        
+        if len(date_col) == 1: # Date specified in single column
+            return times, self._parse_unique(*self._factorize(x_data[date_col[0]]), date_col_format)
+        
+        # Date specified in multiple columns, only unique combinations of the columns are merged
+        codes = x_data.groupby(date_col, sort=False, observed=True).ngroup().to_numpy()
+        uniques = pd.Series(["".join(map(str, values)) for values in x_data[date_col].drop_duplicates().itertuples(index=False)])
+        return times, self._parse_unique(codes, uniques, date_col_format)
+    
+    def _factorize(self, values):
+        """ Codes of values and unique values (codes of categorical columns are used directly) """
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values.cat.codes.to_numpy(), pd.Series(values.cat.categories)
+        codes, uniques = pd.factorize(values)
+        return codes, pd.Series(uniques)
+    
+    def _parse_unique(self, codes, uniques, format_str):
+        """ Parse unique values with the format and broadcast them back by codes """
+        return pd.to_datetime(uniques, format=format_str).to_numpy()[codes]
+
+def _merge_timestamps(times, date_codes, counts, anomalies = None):
+    """ Sort rows by (date, time) and sum event counts (and anomalies) of rows with the same timestamp
+    
+    ### Returns:
+        times, date_codes, counts, anomalies: values of unique timestamps (anomalies are None without labels)
+    """
+    order = np.lexsort((times, date_codes))
+    times, date_codes = times[order], date_codes[order]
+    is_new = np.ones(len(times), dtype=bool)
+    is_new[1:] = (np.diff(times) != 0) | (np.diff(date_codes) != 0)
+    
+    # Bucket of each row (in the original order), duplicate entries of a csr matrix are summed
+    buckets = np.empty(len(times), dtype=np.int64)
+    buckets[order] = np.cumsum(is_new) - 1
+    coo = counts.tocoo()
+    counts = sparse.csr_matrix((coo.data.astype(np.int64), (buckets[coo.row], coo.col)), shape=(int(is_new.sum()), counts.shape[1]))
+    if anomalies is not None:
+        anomalies = np.bincount(buckets, weights=anomalies, minlength=counts.shape[0]).astype(np.int64)
+    return times[is_new], date_codes[is_new], counts, anomalies
 
-        # Count events in each log sequence
-        return np.array(y_data)
\ No newline at end of file
+class EventCountCube:
+    """ Cumulative event counts over the timestamps of a log sequence (grouped by date)
+    
+    ### Args:
+        times (np.ndarray): timestamp of each row (int64 nanoseconds)
+        counts (sparse.csr_matrix): number of occurrences of each event code (column) in each row, a row is
+            a single line or already merged lines of one timestamp
+        date_codes (np.ndarray): (optional) date of each row (numbered in order of first appearance)
+        anomalies (np.ndarray): (optional) number of anomalous lines of each row
+        
+    ### Notes:
+        Rows are sorted by (date, time) and grouped by unique timestamps. Counts of all lines before the k-th
+        timestamp are the dense prefix sum stored for every `_checkpoint_rows`-th timestamp plus the counts of at most
+        `_checkpoint_rows - 1` following timestamps, so the counts of any window are a difference of two such sums
+        and windows never copy the lines. The cube takes (unique timestamps / `_checkpoint_rows` x number of events)
+        integers for the prefix sums and the counts of unique timestamps (csr, at most one entry per line).
+        Integers are int32, unless the log has more than 2^31 - 1 lines (int64).
+    """
+    _block_rows = 4096 # Number of rows densified at once when building the prefix sums and counting windows
+    _checkpoint_rows = 64 # Number of timestamps between two stored prefix sums
+    
+    def __init__(self, times, counts, date_codes = None, anomalies = None):
+        date_codes = np.zeros(len(times), dtype=np.int64) if date_codes is None else np.asarray(date_codes, dtype=np.int64)
+        times, date_codes, counts, anomalies = _merge_timestamps(np.asarray(times), date_codes, counts, anomalies)
+        
+        # Time range of each date
+        self.n_dates = date_codes[-1] + 1 if len(times) > 0 else 0
+        bounds = np.searchsorted(date_codes, np.arange(self.n_dates + 1))
+        self.first, self.last = times[bounds[:-1]], times[bounds[1:] - 1]
+        
+        # Sorting key combining date and time (key of the end of the last window of a date is below the next date)
+        self.t0 = times.min() if len(times) > 0 else 0
+        self.stride = (times.max() - self.t0 if len(times) > 0 else 0) + 2
+        assert self.n_dates * self.stride < 2**62, "Time range is too large for windowing"
+        self.keys = date_codes * self.stride + (times - self.t0)
+        
+        # Cumulative counts never exceed the number of lines
+        self.dtype = np.int32 if counts.sum() < 2**31 else np.int64
+        self.counts = sparse.csr_matrix(counts, dtype=self.dtype)
+        
+        # Prefix sums of event counts before every `_checkpoint_rows`-th timestamp, computed in place for blocks of them
+        n_checkpoints = len(self.keys) // self._checkpoint_rows + 1
+        checkpoint_ids = np.arange(len(self.keys)) // self._checkpoint_rows
+        sums = sparse.csr_matrix((np.ones(len(self.keys), dtype=self.dtype), (checkpoint_ids, np.arange(len(self.keys)))),
+                                 shape=(n_checkpoints, len(self.keys))) @ self.counts
+        self.checkpoints = np.zeros((n_checkpoints, counts.shape[1]), dtype=self.dtype)
+        for start in range(0, n_checkpoints - 1, self._block_rows):
+            end = min(start + self._block_rows, n_checkpoints - 1)
+            np.cumsum(sums[start:end].toarray(), axis=0, out=self.checkpoints[start + 1:end + 1])
+            self.checkpoints[start + 1:end + 1] += self.checkpoints[start]
+        self.label_prefix = None if anomalies is None else np.r_[0, np.cumsum(anomalies)]
+    
+    def cumulative(self, rows):
+        """ Counts of events of all lines before the given timestamps (rows of the cube, from 0 to number of timestamps)
+        
+        ### Returns:
+            prefix (np.ndarray): dense counts (rows x events)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        checkpoint_ids = rows // self._checkpoint_rows
+        
+        # Sum counts of timestamps between the stored prefix sum and each row
+        lengths = rows - checkpoint_ids * self._checkpoint_rows
+        indptr = np.r_[0, np.cumsum(lengths)]
+        indices = np.repeat(checkpoint_ids * self._checkpoint_rows - indptr[:-1], lengths) + np.arange(indptr[-1])
+        between = sparse.csr_matrix((np.ones(indptr[-1], dtype=self.dtype), indices, indptr), shape=(len(rows), len(self.keys)))
+        return self.checkpoints[checkpoint_ids] + (between @ self.counts).toarray()
+    
+    def bounds(self, window_size, window_step):
+        """ Rows of the cube (see `cumulative`) bounding windows of `window_size` minutes repeating every `window_step` seconds
+        (windows of each date start at its first time and repeat up to its last time)
+        
+        ### Returns:
+            starts (np.ndarray): start of each window (int64 nanoseconds)
+            lo, hi (np.ndarray): first and one past the last timestamp of each window
+        """
+        step, size = window_step * 10**9, window_size * 60 * 10**9
+        n_windows = (self.last - self.first) // step + 1
+        window_dates = np.repeat(np.arange(self.n_dates), n_windows)
+        starts = self.first[window_dates] + step * (np.arange(n_windows.sum()) - np.repeat(np.cumsum(n_windows) - n_windows, n_windows))
+        ends = np.minimum(starts + size, self.last[window_dates] + 1)
+        
+        lo = np.searchsorted(self.keys, window_dates * self.stride + (starts - self.t0), side="left")
+        hi = np.searchsorted(self.keys, window_dates * self.stride + (ends - self.t0), side="left")
+        return starts, lo, hi
+    
+    def labels(self, lo, hi):
+        """ Labels of windows bounded by `lo` and `hi` (1 if any line of the window is an anomaly, None without labels) """
+        return None if self.label_prefix is None else (self.label_prefix[hi] - self.label_prefix[lo] > 0).astype(np.int64)
+    
+    def windows(self, window_size, window_step):
+        """ Count events in windows of `window_size` minutes repeating every `window_step` seconds (see `bounds`)
+        
+        ### Returns:
+            starts (DatetimeIndex): start of each window
+            counts (sparse.csr_matrix): number of occurrences of each event code (column) in each window (row)
+            Y (np.ndarray): labels of windows (1 if any line of the window is an anomaly, None without labels)
+        """
+        starts, lo, hi = self.bounds(window_size, window_step)
+        
+        # Differences of cumulative counts are converted to csr for blocks of windows, never for all windows at once
+        blocks = [sparse.csr_matrix((0, self.counts.shape[1]), dtype=self.dtype)]
+        for start in range(0, len(starts), self._block_rows):
+            end = start + self._block_rows
+            blocks.append(sparse.csr_matrix(self.cumulative(hi[start:end]) - self.cumulative(lo[start:end])))
+        
+        return pd.to_datetime(starts), sparse.vstack(blocks, format="csr"), self.labels(lo, hi)
@@ -0,0 +1,92 @@
+"""
+Binary file format of the knowledge base
+
+Layout of the file:
+    magic (8 bytes) | format version (uint32) | header length (uint32) | JSON header | arrays
+
+The header stores parameters of the model (thresholds, events, feature extraction) and the position
+of each array. Arrays are stored in C order, each aligned to 64 bytes, so they can be memory mapped.
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+
+MAGIC = b"LOGCLKB\x00"
+VERSION = 1
+_prefix = struct.Struct("<8sII")
+_align = 64
+
+def _aligned(offset):
+    return -(-offset // _align) * _align
+
+def write_base(path, header, arrays):
+    """ Write knowledge base file
+
+    ### Args:
+        path (str): path of the file (replaced atomically, so memory mapped readers of the old file are not affected)
+        header (dict): JSON serializable parameters of the knowledge base
+        arrays (dict): arrays stored after the header (name -> np.ndarray)
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # Offsets of arrays relative to the start of the data section
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+
+    raw_header = json.dumps({**header, "arrays": layout}).encode("utf-8")
+    data_start = _aligned(_prefix.size + len(raw_header))
+
+    file = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)), delete=False)
+    try:
+        file.write(_prefix.pack(MAGIC, VERSION, len(raw_header)))
+        file.write(raw_header)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]["offset"])
+            file.write(array.tobytes())
+        file.close()
+        os.replace(file.name, path)
+    except BaseException:
+        file.close()
+        os.remove(file.name)
+        raise
+
+def read_base(path):
+    """ Read knowledge base file, arrays are memory mapped read-only (loaded lazily on access)
+
+    ### Args:
+        path (str): path of the file
+
+    ### Returns:
+        header (dict): parameters of the knowledge base
+        arrays (dict): memory mapped arrays (name -> np.memmap)
+    """
+    with open(path, "rb") as file:
+        prefix = file.read(_prefix.size)
+        assert len(prefix) == _prefix.size and prefix[:len(MAGIC)] == MAGIC, f"{path} is not a knowledge base file"
+        _, version, header_len = _prefix.unpack(prefix)
+        assert version <= VERSION, f"Unsupported knowledge base version {version} (supported up to {VERSION})"
+        header = json.loads(file.read(header_len).decode("utf-8"))
+
+    data_start = _aligned(_prefix.size + header_len)
+    arrays = {}
+    for name, spec in header.pop("arrays").items():
+        shape = tuple(spec["shape"])
+        if np.prod(shape) == 0:
+            arrays[name] = np.empty(shape, dtype=spec["dtype"]) # Empty arrays cannot be memory mapped
+        else:
+            arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r", offset=data_start + spec["offset"], shape=shape)
+
+    return header, arrays
+
+def is_base_file(path):
+    """ Check whether the file is in the binary knowledge base format (e.g to detect old pickled bases) """
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
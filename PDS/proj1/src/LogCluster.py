@@ -11,25 +11,77 @@ import pandas as pd
 import pickle as pkl
 import matplotlib.pyplot as plt
 
-from scipy.spatial.distance import pdist, squareform
+from scipy import sparse
+
+from scipy.spatial.distance import pdist
 from scipy.cluster.hierarchy import linkage, fcluster
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 
-from .utils import Log
+from .utils import Log, normalize_rows, frame_values
+from .EventVocabulary import EventVocabulary
+from .FeatureExtraction import FeatureExtraction
+from .KnowledgeBaseFile import write_base, read_base, is_base_file
+from .ScoringModels.BatchScoring import BatchScoring
+from .ScoringModels.InvertedIndexScoring import InvertedIndexScoring
+from .ScoringModels.LSHScoring import LSHScoring
+from .ScoringModels.ParallelScoring import ParallelScoring
+from .ClusteringModels.BlockedDistance import BlockedDistance
+from .ClusteringModels.RadiusGraphClustering import RadiusGraphClustering
+from .ClusteringModels.LeaderClustering import LeaderClustering
 
 class LogCluster(Log):
-    _cluster_col = "ClusterId"
+    """ LogCluster anomaly detection model
+    
+    ### Args:
+        max_dist (float): maximum distance to group clusters together
+        threshold (float): anomaly detection threshold
+        contrast_w (bool): whether contrast based weighting is used
+        logging (bool): enable logging
+        block_size (int): number of windows scored at once
+        scoring (str): nearest centroid search, 'batch', 'index' or 'lsh' (default = 'batch')
+        lsh_tables (int): number of hash tables of 'lsh' scoring
+        lsh_bits (int): number of bits of each hash of 'lsh' scoring
+        max_fit_memory_mb (int): (optional) memory budget for pairwise distances in fit
+        fit_tmp_dir (str): (optional) directory for memory mapped pairwise distances
+        clustering (str): clustering of training windows, 'hierarchical', 'radius' or 'leader' (default = 'hierarchical')
+        workers (int): number of processes of 'batch' scoring, which share a single copy of the knowledge base
+            (default = 1, session ids are extracted by processes of `FeatureExtraction`)
+    """
     _noise = 1e-8
     
-    def __init__(self, max_dist: int = None, threshold: int = None, contrast_w = False, logging: bool = True):
+    def __init__(self, max_dist: int = None, threshold: int = None, contrast_w = False, logging: bool = True,
+                 block_size: int = 1024, scoring: str = "batch", lsh_tables: int = 8, lsh_bits: int = 12,
+                 max_fit_memory_mb: int = None, fit_tmp_dir: str = None, clustering: str = "hierarchical",
+                 workers: int = 1):
         super().__init__(self.__class__.__name__, logging)
         self.max_dist = max_dist
         self.threshold = threshold
         self.contrast_w = contrast_w
+        self.block_size = block_size
+        self.scoring = scoring
+        self.lsh_tables = lsh_tables
+        self.lsh_bits = lsh_bits
+        self.max_fit_memory_mb = max_fit_memory_mb
+        self.fit_tmp_dir = fit_tmp_dir
+        self.clustering = clustering
+        self.workers = workers
         
         # Knowledge base
         self.centroids = []
-        self.events = None
+        self.vocabulary = None # Events of the knowledge base, columns of centroids (see `events`)
+        
+        # Scoring engine built from the knowledge base (rebuilt whenever centroids change)
+        self._scoring = None
+        self._lsh = None # Hash tables (hyperplanes and centroid codes) of the approximate scoring
+    
+    @property
+    def events(self):
+        """ Events of the knowledge base (in order of the columns of centroids) """
+        return None if self.vocabulary is None else self.vocabulary.index
+    
+    @events.setter
+    def events(self, events):
+        self.vocabulary = None if events is None else EventVocabulary(events)
     
     def fit(self, X):
         """ Fit LogCluster model on the given data X 
@@ -39,47 +91,94 @@ class LogCluster(Log):
         """
         self.log(10 * "-" + f" Fitting LogCluster model " + 10 * "-")
         
-        # Add small noise to the data to avoid zero-length vectors in cosine distance
-        X += self._noise
+        # Windows are converted to a matrix once (csr for sparse frames), small noise avoids zero-length vectors
+        values = self._add_noise(frame_values(X))
         
-        # Agglomerative clustering
-        p_dist = pdist(X, metric='cosine')
-        Z = linkage(p_dist, 'complete')
-        cluster_index = fcluster(Z, self.max_dist, criterion='distance')
+        n_clusters = self._cluster(values, X.columns)
+        self._build_scoring()
         
-        # Extract representatives and events
-        X.insert(0, self._cluster_col, cluster_index)
-        self._init_knowledge_base(X, p_dist)
+        self.log(f"Number of clusters: {n_clusters}")
+        
+    def partial_fit(self, X):
+        """ Update the knowledge base with new normal data X
         
-        self.log(f"Number of clusters: {len(set(cluster_index))}")
+        Windows within `max_dist` from an existing centroid are already represented by the knowledge base,
+        only the remaining windows are clustered and their centroids are added to the knowledge base.
         
-    def predict(self, X):
+        ### Args:
+            X (pd.DataFrame): New data to update the model with
+        """
+        if len(self.centroids) == 0:
+            return self.fit(X)
+        
+        self.log(10 * "-" + f" Updating LogCluster model " + 10 * "-")
+        
+        # Align new windows with the knowledge base (new events are added to centroids)
+        self._synchronize_events(X)
+        X = self._align_events(X)
+        values = self._add_noise(frame_values(X))
+        
+        # Find windows which are not represented by any centroid
+        distcs, _ = self._scoring.query(values)
+        values_new = values[~(distcs <= self.max_dist)]
+        self.log(f"{X.shape[0] - values_new.shape[0]} windows assigned to existing centroids, clustering {values_new.shape[0]} windows")
+        
+        if values_new.shape[0] > 0:
+            n_clusters = self._cluster(values_new, X.columns)
+            self._build_scoring()
+            self.log(f"Number of new clusters: {n_clusters}")
+        
+    def predict(self, X, return_nearest = False):
         """ Predict anomalies in the given data X
 
         ### Args:
             X (pd.DataFrame): Data to predict on
+            return_nearest (bool): also return index of the nearest centroid
 
         ### Returns:
             y_pred (np.ndarray): Predicted labels
             distcs (np.ndarray): Distances to nearest cluster
+            nearest (np.ndarray): (optional) Index of the nearest centroid
         """
-        y_pred = np.zeros(X.shape[0])
-        
         self._synchronize_events(X)
         
-        distcs = []
-        # Calculate distance of each prediction to nearest cluster
-        for i in range(X.shape[0]):
-            # Add current sample to centroids
-            centroids = self.centroids.copy()
-            centroids.insert(0, X.iloc[i].to_list())
-            # Calculate cosine distance to all centroids
-            dist = squareform(pdist(centroids, metric='cosine'))[0]
-            min_dist = np.min(dist[1:])
-            distcs.append(min_dist)
-            if min_dist > self.threshold:
-                y_pred[i] = 1
-        return y_pred, np.array(distcs)
+        # Score windows in blocks against the precomputed centroid matrix
+        distcs, nearest = self._scoring.query(frame_values(self._align_events(X)))
+        y_pred = (distcs > self.threshold).astype(float)
+        
+        if return_nearest:
+            return y_pred, distcs, nearest
+        return y_pred, distcs
+    
+    def compact(self, eps):
+        """ Merge centroids of the knowledge base closer than `eps`
+        
+        Centroids are grouped with complete linkage cut at `eps` (all centroids of a group are within `eps`
+        from each other) and each group is replaced by a single representative.
+        
+        ### Args:
+            eps (float): maximum cosine distance of merged centroids
+            
+        ### Returns:
+            removed (int): number of removed centroids
+        """
+        self.log(10 * "-" + f" Compacting knowledge base (eps = {eps}) " + 10 * "-")
+        
+        centroids = np.asarray(self._padded_centroids())
+        cluster_index = RadiusGraphClustering(eps, self.block_size, logging=self.do_print).fit_predict(centroids)
+        
+        # Replace centroids with representatives of the groups
+        self.centroids = []
+        self._init_knowledge_base(centroids, cluster_index, self.events)
+        
+        # Hash codes of removed centroids are no longer valid (hyperplanes are kept)
+        if self._lsh is not None:
+            self._lsh = {"planes": self._lsh["planes"], "codes": None}
+        self._build_scoring()
+        
+        removed = centroids.shape[0] - len(self.centroids)
+        self.log(f"Centroids: {centroids.shape[0]} -> {len(self.centroids)} ({100 * removed / centroids.shape[0]:.1f} % removed)")
+        return removed
     
     def evaluate(self, X, y_true, debug = False):
         """ Evaluate model on the given data X and true labels y_true
@@ -98,6 +197,9 @@ class LogCluster(Log):
         """
         y_pred, distances = self.predict(X)
         
+        if self.scoring == "lsh":
+            self.log("Recall of approximate scoring: {:.3f}".format(self.scoring_recall(X)))
+        
         if debug:
             anomal = np.histogram(distances[y_true == 1], bins=30)
             for i in range(len(anomal[0])):
@@ -118,29 +220,76 @@ class LogCluster(Log):
         ### Args:
             path (str): Path to export knowledge base to
             fe (FeatureExtraction): Feature extraction object (to transform validation data)
+            
+        ### Notes:
+            Centroids are stored as a float32 matrix in the binary format of `KnowledgeBaseFile`
+            together with the parameters of the model and the feature extraction.
         """
         self.log(f"Exporting knowledge base")
-        storage = {"centroids": self.centroids, "events": self.events, "dist": self.max_dist, "thr" : self.threshold, "contrast_w": self.contrast_w, "feature_extraction": feature_extraction}
-        file = open(path, "wb")
-        pkl.dump(storage, file)
-        file.close()
+        header = {
+            "events": list(self.events),
+            "dist": self.max_dist,
+            "thr": self.threshold,
+            "contrast_w": bool(self.contrast_w),
+            "feature_extraction": feature_extraction.get_params(),
+        }
+        arrays = {"centroids": np.asarray(self._padded_centroids(), dtype=np.float32).reshape(-1, len(self.events))}
+        if self._lsh is not None and self._lsh["codes"] is not None:
+            arrays["lsh_planes"] = self._lsh["planes"]
+            arrays["lsh_codes"] = self._lsh["codes"]
+        write_base(path, header, arrays)
         
-    def import_base(self, path):
+    def import_base(self, path, **fe_options):
         """ Import knowledge base from file
 
         ### Args:
             path (str): Path to import knowledge base from
+            fe_options: runtime options of the returned feature extraction (see `FeatureExtraction.from_params`)
+            
+        ### Returns:
+            fe (FeatureExtraction): Feature extraction object stored with the knowledge base
+            
+        ### Notes:
+            Centroids are memory mapped read-only, they are read from the file only when they are used.
         """
         self.log(f"Importing knowledge base")
+        assert is_base_file(path), f"{path} is not a knowledge base file (use scripts/convert_base.py for pickled knowledge bases)"
+        header, arrays = read_base(path)
+        
+        self.centroids = arrays["centroids"]
+        self.events = pd.Index(header["events"])
+        self.max_dist = header["dist"]
+        self.threshold = header["thr"]
+        self.contrast_w = header["contrast_w"]
+        self._lsh = {"planes": arrays["lsh_planes"], "codes": arrays["lsh_codes"]} if "lsh_planes" in arrays else None
+        self._build_scoring()
+        
+        return FeatureExtraction.from_params(header["feature_extraction"], self.do_print, **fe_options)
+    
+    def import_pickle_base(self, path):
+        """ Import knowledge base from pickle file (format used before `KnowledgeBaseFile`)
+
+        ### Args:
+            path (str): Path to import knowledge base from
+            
+        ### Returns:
+            fe (FeatureExtraction): Feature extraction object stored with the knowledge base
+            
+        ### Notes:
+            Unpickling can execute arbitrary code, only use this to convert trusted knowledge bases.
+        """
+        self.log(f"Importing pickled knowledge base")
         file = open(path, "rb")
         storage = pkl.load(file)
         file.close()
         
         self.centroids = storage["centroids"]
-        self.events = storage["events"]
+        self.events = pd.Index(storage["events"])
         self.max_dist = storage["dist"]
         self.threshold = storage["thr"]
         self.contrast_w = storage["contrast_w"]
+        self._lsh = storage.get("lsh")
+        self._build_scoring()
         
         return storage["feature_extraction"]
     
@@ -157,38 +306,172 @@ class LogCluster(Log):
         anomalies = X[y_pred == 1]
         return anomalies
     
-    def _init_knowledge_base(self, X, p_dist):
+    def scoring_recall(self, X):
+        """ Measure how often the configured scoring finds the same nearest centroid as the exact search
+
+        ### Args:
+            X (pd.DataFrame): Data to measure the recall on
+
+        ### Returns:
+            recall (float): Fraction of windows with the exact nearest distance
+        """
+        self._synchronize_events(X)
+        values = frame_values(self._align_events(X))
+        distcs, _ = self._scoring.query(values)
+        exact, _ = BatchScoring(self.centroids, self.block_size, logging=False).query(values)
+        
+        # Compare distances rather than indices, so equally distant centroids are not counted as misses
+        found = np.isclose(distcs, exact, rtol=0, atol=1e-9) | (np.isnan(distcs) & np.isnan(exact))
+        return np.mean(found)
+    
+    def _cluster(self, values, events):
+        """ Cluster windows and add their centroids to the knowledge base
+
+        ### Args:
+            values (np.ndarray | sparse.csr_matrix): windows (one per row, see `frame_values`)
+            events (pd.Index): events of the columns of windows
+
+        ### Returns:
+            n_clusters (int): number of created clusters
+        """
+        # Cluster only unique windows, duplicates are merged at distance 0 by complete linkage anyway
+        unique, counts = self._unique_rows(values)
+        self.log(f"Clustering {unique.shape[0]} unique windows out of {values.shape[0]}")
+        
+        # Agglomerative clustering
+        assert self.clustering in ["hierarchical", "radius", "leader"], "Invalid clustering type"
+        if self.clustering == "radius":
+            cluster_index = RadiusGraphClustering(self.max_dist, self.block_size, logging=self.do_print).fit_predict(unique)
+        elif self.clustering == "leader":
+            cluster_index = LeaderClustering(self.max_dist, self.block_size, logging=self.do_print).fit_predict(unique)
+        else:
+            cluster_index = self._hierarchical_clustering(unique)
+        
+        # Extract representatives and events
+        self._init_knowledge_base(unique, cluster_index, events, counts)
+        return len(set(cluster_index))
+    
+    def _hierarchical_clustering(self, values):
+        """ Complete linkage clustering of windows cut at `max_dist` """
+        if values.shape[0] == 1:
+            return np.ones(1, dtype=np.int64) # Linkage requires at least two samples
+        
+        # Distances are computed in tiles if memory budget is set (or windows are sparse), float32 tiles are
+        # used only to fit into the budget, so sparse and dense windows are clustered with the same precision
+        if self.max_fit_memory_mb is not None or sparse.issparse(values):
+            dtype = np.float64 if self.max_fit_memory_mb is None else np.float32
+            p_dist = BlockedDistance(self.max_fit_memory_mb, self.fit_tmp_dir, dtype, logging=self.do_print).pdist(values)
+        else:
+            p_dist = pdist(values, metric='cosine')
+        Z = linkage(p_dist, 'complete')
+        return fcluster(Z, self.max_dist, criterion='distance')
+    
+    def _unique_rows(self, values):
+        """ Collapse identical windows (in order of their first appearance)
+
+        ### Returns:
+            unique (np.ndarray | sparse.csr_matrix): unique windows
+            counts (np.ndarray): number of occurrences of each unique window
+        """
+        if sparse.issparse(values):
+            # Rows of canonical csr matrix are identical if their indices and values are
+            values = sparse.csr_matrix(values, copy=True)
+            values.eliminate_zeros()
+            values.sort_indices()
+            keys = [values.indices[a:b].tobytes() + values.data[a:b].tobytes() for a, b in zip(values.indptr[:-1], values.indptr[1:])]
+            codes, _ = pd.factorize(pd.Series(keys)) # Codes are numbered in order of first appearance
+            _, first = np.unique(codes, return_index=True)
+            return values[first], np.bincount(codes)
+        
+        _, first, counts = np.unique(values, axis=0, return_index=True, return_counts=True)
+        order = np.argsort(first)
+        return values[first[order]], counts[order]
+    
+    def _init_knowledge_base(self, values, labels, events, counts = None):
         """ Initialize knowledge base with centroids and events
 
         ### Args:
-            X (pd.DataFrame): Data to initialize knowledge base on
-            p_dist (np.ndarray): Pairwise distances between samples
+            values (np.ndarray | sparse.csr_matrix): clustered windows (one per row)
+            labels (np.ndarray): cluster of each window
+            events (pd.Index): events of the columns of windows
+            counts (np.ndarray): (optional) Number of occurrences of each sample
+            
+        ### Notes:
+            Score of each sample is its average cosine distance to all samples. Cosine distance is linear
+            in the normalized vectors, so `sum_j w_j * d(i, j) = sum(w) - x_i . sum_j w_j * x_j` is computed
+            without pairwise distances in O(n * events) time and memory.
         """
         # Store events
-        self.events = X.columns[1:]
-        
-        # Extract centroids
-        distances = squareform(p_dist)
-        for cluster in set(X[self._cluster_col]):
-            # Get all events from current cluster
-            cluster_idx = X[self._cluster_col] == cluster
-            # Calculate scores for each event in cluster
-            scores = np.divide(np.sum(distances[cluster_idx], axis=1), cluster_idx.shape[0])
-            # Get event with lowest score as centroid
-            centroid = X[cluster_idx].iloc[np.argmin(scores)][1:]
-            self.centroids.append(centroid.to_list())
+        self.events = events
+        if counts is None:
+            counts = np.ones(values.shape[0])
+        
+        # Calculate scores for each sample (each sample weighted by its occurrences)
+        X_norm, _ = normalize_rows(values.astype(np.float64))
+        scores = (np.sum(counts) - X_norm @ (counts @ X_norm)) / np.sum(counts)
+        
+        # Get sample with lowest score in each cluster as centroid (first one in case of a tie)
+        labels = np.asarray(labels)
+        order = np.lexsort((np.arange(values.shape[0]), scores, labels))
+        first = np.flatnonzero(np.diff(labels[order], prepend=labels[order][0] - 1))
+        centroids = values[order[first]]
+        centroids = np.asarray(centroids.toarray() if sparse.issparse(centroids) else centroids, dtype=np.float64)
+        self.centroids = centroids if len(self.centroids) == 0 else np.vstack([self._padded_centroids(), centroids])
             
+    def _add_noise(self, values):
+        """ Add small noise to the windows to avoid zero-length vectors in cosine distance (noise in every value
+        would make sparse windows dense, so sparse windows get the noise only in empty windows) """
+        if not sparse.issparse(values):
+            return np.asarray(values, dtype=np.float64) + self._noise
+        empty = np.flatnonzero(np.asarray(abs(values).sum(axis=1)).ravel() == 0)
+        if empty.shape[0] == 0:
+            return values
+        rows = np.repeat(empty, values.shape[1])
+        cols = np.tile(np.arange(values.shape[1]), empty.shape[0])
+        return sparse.csr_matrix(values + sparse.csr_matrix((np.full(rows.shape[0], self._noise), (rows, cols)), shape=values.shape))
+    
+    def _align_events(self, X):
+        """ Reorder columns of X to events of the knowledge base (missing events are zero) """
+        return self.vocabulary.align(X)
+    
     def _synchronize_events(self, X):
         """ Synchronize events in the given data X with the knowledge base """
-        # Get difference between current and stored events
-        new_events = list(set(X.columns) - set(self.events))
-        # Add new events to centroids
-        new_centroids = pd.DataFrame(self.centroids, columns=self.events)
-        if self.contrast_w:
-            new_centroids[new_events] = 0.25 # Default value for contrast weighting
+        # New events get the next ids of the vocabulary, so they are the last columns of centroids
+        added = self.vocabulary.add(X.columns)
+        if added == 0 or not self.contrast_w:
+            # New events are zero in all centroids, scoring treats columns beyond the centroids as zeros,
+            # so (memory mapped) centroids are not copied, see `_padded_centroids`
+            return
+        default = 0.25 # Default value for contrast weighting
+        self.centroids = np.hstack([np.asarray(self.centroids), np.full((len(self.centroids), added), default)])
+        self._build_scoring()
+    
+    def _padded_centroids(self):
+        """ Centroids with a column for every event of the knowledge base (events added after the centroids are zero) """
+        if len(self.centroids) == 0 or np.shape(self.centroids)[1] == len(self.vocabulary):
+            return self.centroids
+        centroids = np.asarray(self.centroids)
+        return np.hstack([centroids, np.zeros((centroids.shape[0], len(self.vocabulary) - centroids.shape[1]), dtype=centroids.dtype)])
+        
+    def _build_scoring(self):
+        """ Precompute scoring structures for the current knowledge base """
+        assert self.scoring in ["batch", "index", "lsh"], "Invalid scoring type"
+        
+        # Worker processes of the previous scoring are attached to the previous centroids
+        if isinstance(self._scoring, ParallelScoring):
+            self._scoring.close()
+        
+        # Contrast weighting makes every window dense, so the inverted index would not prune anything
+        if self.scoring == "index" and not self.contrast_w:
+            self._scoring = InvertedIndexScoring(self.centroids, self.block_size, logging=self.do_print)
+        elif self.scoring == "lsh":
+            # Reuse hash tables of the knowledge base if they were built with the same parameters
+            planes, codes = None, None
+            if self._lsh is not None and self._lsh["planes"].shape[:2] == (self.lsh_tables, self.lsh_bits):
+                planes, codes = self._lsh["planes"], self._lsh["codes"]
+            self._scoring = LSHScoring(self.centroids, self.block_size, self.lsh_tables, self.lsh_bits, planes, codes, logging=self.do_print)
+            self._lsh = {"planes": self._scoring.planes, "codes": self._scoring.codes}
+        elif self.workers > 1:
+            self._scoring = ParallelScoring(self.centroids, self.block_size, self.workers, logging=self.do_print)
         else:
-            new_centroids[new_events] = 0
-        # Sort columns
-        new_centroids = new_centroids.reindex(sorted(new_centroids.columns, key=lambda x: int(x[1:])), axis=1)
-        self.events = new_centroids.columns
-        self.centroids = new_centroids.values.tolist()
\ No newline at end of file
+            self._scoring = BatchScoring(self.centroids, self.block_size, logging=self.do_print)
\ No newline at end of file
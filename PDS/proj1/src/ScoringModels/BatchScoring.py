@@ -0,0 +1,71 @@
+"""
+Exact nearest centroid search with blocked matrix products
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import numpy as np
+from scipy import sparse
+
+from ..utils import Log, normalize_rows
+
+class BatchScoring(Log):
+    """ Score windows against all centroids of the knowledge base in fixed-size blocks
+
+    ### Args:
+        centroids (np.ndarray): centroids of the knowledge base (one per row)
+        block_size (int): number of windows scored with a single matrix product
+        logging (bool): enable logging
+
+    ### Notes:
+        Only the norms of the centroids are computed when the scoring is created, so the cosine
+        distance of a block of windows is `1 - (X_norm @ C.T) / |C|`. Floating point centroids
+        (e.g memory mapped or shared knowledge base) are used without copying, in their own precision.
+    """
+
+    def __init__(self, centroids, block_size = 1024, logging = True):
+        super().__init__(self.__class__.__name__, logging)
+        self.block_size = block_size
+        self.centroids = np.asarray(centroids)
+        if not np.issubdtype(self.centroids.dtype, np.floating):
+            self.centroids = self.centroids.astype(np.float64)
+
+        # Norms are computed in blocks, so the whole matrix is never copied
+        norms = np.zeros(self.centroids.shape[0])
+        for start in range(0, self.centroids.shape[0], block_size):
+            norms[start:start + block_size] = np.linalg.norm(self.centroids[start:start + block_size], axis=1)
+        self.inv_norms = np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0).astype(self.centroids.dtype)
+
+    def query(self, X):
+        """ Find the nearest centroid for each window in X
+
+        ### Args:
+            X (np.ndarray | sparse.csr_matrix): windows to score (columns aligned with centroids, columns
+                beyond the centroids are events missing in the knowledge base and are zero in all centroids)
+
+        ### Returns:
+            distances (np.ndarray): cosine distance to the nearest centroid (NaN for zero windows)
+            nearest (np.ndarray): index of the nearest centroid (-1 for zero windows)
+        """
+        X = sparse.csr_matrix(X, dtype=np.float64) if sparse.issparse(X) else np.asarray(X, dtype=np.float64)
+        distances = np.full(X.shape[0], np.nan)
+        nearest = np.full(X.shape[0], -1, dtype=np.int64)
+
+        for start in range(0, X.shape[0], self.block_size):
+            block, norms = normalize_rows(X[start:start + self.block_size], self.centroids.shape[1])
+            distances[start:start + block.shape[0]], nearest[start:start + block.shape[0]] = self._score_block(block, norms)
+
+        return distances, nearest
+
+    def _score_block(self, block, norms):
+        """ Score block of normalized windows against all centroids """
+        sim = (block.astype(self.centroids.dtype) @ self.centroids.T) * self.inv_norms
+        nearest = np.argmax(sim, axis=1)
+        distances = np.clip(1 - sim[np.arange(block.shape[0]), nearest], 0, 2)
+
+        # Cosine distance is undefined for zero-length windows
+        zero = norms == 0
+        distances[zero] = np.nan
+        nearest[zero] = -1
+        return distances, nearest
@@ -0,0 +1,108 @@
+"""
+Exact nearest centroid search with inverted index over events
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+from ..utils import Log, normalize_rows
+
+class InvertedIndexScoring(Log):
+    """ Score windows only against centroids sharing at least one event with them
+
+    ### Args:
+        centroids (np.ndarray): centroids of the knowledge base (one per row)
+        block_size (int): number of windows looked up in the index at once
+        tol (float): centroid values up to `tol` (e.g the noise added in fit) are not indexed
+        noise_norm (float): centroids shorter than `noise_norm` are scored against every window
+        logging (bool): enable logging
+
+    ### Notes:
+        The search is exact. A centroid `c` that is not a candidate for window `x` only shares
+        values below `tol` with it, so its cosine similarity is at most `tol * |x|_1 / (|x| * |c|)`.
+        Windows whose best candidate does not beat this bound are scored against all centroids,
+        which also covers windows without any indexed event (e.g all-zero windows).
+    """
+
+    def __init__(self, centroids, block_size = 1024, tol = 1e-6, noise_norm = 1e-3, logging = True):
+        super().__init__(self.__class__.__name__, logging)
+        self.block_size = block_size
+        self.tol = tol
+
+        centroids = np.asarray(centroids, dtype=np.float64)
+        centroids_norm, norms = normalize_rows(centroids)
+        # Keep normalized centroids event-major, so values of one event are contiguous
+        self.centroids = np.ascontiguousarray(centroids_norm.T)
+
+        # Map each event to the centroids containing it (columns of the transposed support matrix)
+        support = np.abs(centroids) > tol
+        self.always = np.flatnonzero((support.sum(axis=1) == 0) | (norms < noise_norm))
+        support[self.always] = False
+        self.index = csr_matrix(support.T, dtype=np.int32)
+
+        # Shortest indexed centroid bounds the similarity of centroids outside candidates
+        indexed = np.setdiff1d(np.arange(centroids.shape[0]), self.always)
+        self.min_norm = norms[indexed].min() if indexed.shape[0] > 0 else np.inf
+
+        self.log(f"Indexed {indexed.shape[0]} centroids, {self.always.shape[0]} scored for every window")
+
+    def query(self, X):
+        """ Find the nearest centroid for each window in X
+
+        ### Args:
+            X (np.ndarray | csr_matrix): windows to score (columns aligned with centroids, columns beyond
+                the centroids are events missing in the knowledge base and are zero in all centroids)
+
+        ### Returns:
+            distances (np.ndarray): cosine distance to the nearest centroid (NaN for zero windows)
+            nearest (np.ndarray): index of the nearest centroid (-1 for zero windows)
+        """
+        X = csr_matrix(X, dtype=np.float64) if issparse(X) else np.asarray(X, dtype=np.float64)
+        distances = np.full(X.shape[0], np.nan)
+        nearest = np.full(X.shape[0], -1, dtype=np.int64)
+
+        for start in range(0, X.shape[0], self.block_size):
+            block = X[start:start + self.block_size]
+            distances[start:start + block.shape[0]], nearest[start:start + block.shape[0]] = self._score_block(block)
+
+        return distances, nearest
+
+    def _score_block(self, block):
+        """ Score block of windows against candidate centroids from the index """
+        block_norm, norms = normalize_rows(block, self.centroids.shape[0])
+        block = block[:, :self.centroids.shape[0]]
+        distances = np.full(block.shape[0], np.nan)
+        nearest = np.full(block.shape[0], -1, dtype=np.int64)
+
+        # Candidates of each window are the union of posting lists of its events
+        candidates = csr_matrix(block != 0, dtype=np.int32) @ self.index
+        bounds = self.tol * np.asarray(abs(block).sum(axis=1)).ravel() / (np.where(norms > 0, norms, 1) * self.min_norm)
+
+        for i in np.flatnonzero(norms > 0):
+            cand = candidates.indices[candidates.indptr[i]:candidates.indptr[i + 1]]
+            if self.always.shape[0] > 0:
+                cand = np.union1d(cand, self.always)
+
+            # Only nonzero events of the window contribute to the dot product
+            if issparse(block_norm):
+                events = block_norm.indices[block_norm.indptr[i]:block_norm.indptr[i + 1]]
+                values = block_norm.data[block_norm.indptr[i]:block_norm.indptr[i + 1]]
+            else:
+                events = np.flatnonzero(block[i])
+                values = block_norm[i, events]
+            sim = values @ self.centroids[np.ix_(events, cand)]
+
+            # Fall back to all centroids if a centroid outside candidates could be closer
+            if cand.shape[0] == 0 or sim.max() <= bounds[i]:
+                cand = np.arange(self.centroids.shape[1])
+                sim = values @ self.centroids[events]
+
+            # Candidates are not ordered, ties are resolved to the lowest centroid index
+            best = sim.max()
+            nearest[i] = cand[sim == best].min()
+            distances[i] = np.clip(1 - best, 0, 2)
+
+        return distances, nearest
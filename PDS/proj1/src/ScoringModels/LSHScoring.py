@@ -0,0 +1,109 @@
+"""
+Approximate nearest centroid search with random hyperplane (SimHash) hashing
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import numpy as np
+from scipy import sparse
+
+from ..utils import Log, normalize_rows
+
+class LSHScoring(Log):
+    """ Score windows only against centroids falling into the same hash bucket in any of the tables
+
+    ### Args:
+        centroids (np.ndarray): centroids of the knowledge base (one per row)
+        block_size (int): number of windows hashed at once
+        tables (int): number of hash tables
+        bits (int): number of hyperplanes (bits of the hash) in each table (at most 64)
+        planes (np.ndarray): (optional) hyperplanes of previously built tables (tables x bits x events)
+        codes (np.ndarray): (optional) hash codes of the centroids computed with `planes` (tables x centroids)
+        seed (int): seed of the random hyperplanes
+        logging (bool): enable logging
+
+    ### Notes:
+        More tables increase the chance of finding the nearest centroid, more bits make the buckets
+        smaller (faster, but less accurate). Windows without any candidate are scored against all centroids.
+    """
+
+    def __init__(self, centroids, block_size = 1024, tables = 8, bits = 12, planes = None, codes = None, seed = 0, logging = True):
+        super().__init__(self.__class__.__name__, logging)
+        assert 0 < bits <= 64, "Number of bits must be between 1 and 64"
+        self.block_size = block_size
+        self.centroids, _ = normalize_rows(np.asarray(centroids, dtype=np.float64))
+        n_events = self.centroids.shape[1]
+
+        # Reuse stored hyperplanes, new events get new random components (from a stream seeded by the number
+        # of already stored events, so they do not repeat the components of the stored hyperplanes)
+        if planes is None:
+            planes = np.random.default_rng(seed).standard_normal((tables, bits, n_events))
+        elif planes.shape[2] < n_events:
+            rng = np.random.default_rng([seed, planes.shape[2]])
+            extra = rng.standard_normal((planes.shape[0], planes.shape[1], n_events - planes.shape[2]))
+            planes = np.concatenate([planes, extra], axis=2)
+            codes = None
+        self.planes = planes
+
+        if codes is None or codes.shape[1] != self.centroids.shape[0]:
+            codes = self._hash(self.centroids)
+        self.codes = codes
+
+        # Buckets of each table are stored as centroid ids sorted by their hash code
+        self._order = np.argsort(self.codes, axis=1, kind="stable")
+        self._sorted_codes = np.take_along_axis(self.codes, self._order, axis=1)
+
+        self.log(f"Hashed {self.centroids.shape[0]} centroids into {self.planes.shape[0]} tables of {self.planes.shape[1]} bits")
+
+    def query(self, X):
+        """ Find the (approximately) nearest centroid for each window in X
+
+        ### Args:
+            X (np.ndarray | sparse.csr_matrix): windows to score (columns aligned with centroids, columns
+                beyond the centroids are events missing in the knowledge base and are zero in all centroids)
+
+        ### Returns:
+            distances (np.ndarray): cosine distance to the nearest centroid found (NaN for zero windows)
+            nearest (np.ndarray): index of the nearest centroid found (-1 for zero windows)
+        """
+        X = sparse.csr_matrix(X, dtype=np.float64) if sparse.issparse(X) else np.asarray(X, dtype=np.float64)
+        distances = np.full(X.shape[0], np.nan)
+        nearest = np.full(X.shape[0], -1, dtype=np.int64)
+
+        for start in range(0, X.shape[0], self.block_size):
+            block, norms = normalize_rows(X[start:start + self.block_size], self.centroids.shape[1])
+            distances[start:start + block.shape[0]], nearest[start:start + block.shape[0]] = self._score_block(block, norms)
+
+        return distances, nearest
+
+    def _hash(self, X):
+        """ Compute hash codes of normalized vectors in each table (tables x vectors) """
+        tables, n_bits, n_events = self.planes.shape
+        projection = np.asarray(X @ self.planes.reshape(tables * n_bits, n_events).T).reshape(X.shape[0], tables, n_bits)
+        bits = (projection.transpose(1, 0, 2) > 0).astype(np.uint64)
+        weights = np.left_shift(np.uint64(1), np.arange(self.planes.shape[1], dtype=np.uint64))
+        return (bits * weights).sum(axis=2, dtype=np.uint64)
+
+    def _score_block(self, block, norms):
+        """ Score block of normalized windows against centroids from matching buckets """
+        distances = np.full(block.shape[0], np.nan)
+        nearest = np.full(block.shape[0], -1, dtype=np.int64)
+
+        # Find bucket range of each window in every table
+        codes = self._hash(block)
+        lower = np.stack([np.searchsorted(self._sorted_codes[t], codes[t], side="left") for t in range(codes.shape[0])])
+        upper = np.stack([np.searchsorted(self._sorted_codes[t], codes[t], side="right") for t in range(codes.shape[0])])
+
+        for i in np.flatnonzero(norms > 0):
+            cand = np.unique(np.concatenate([self._order[t, lower[t, i]:upper[t, i]] for t in range(codes.shape[0])]))
+            if cand.shape[0] == 0:
+                cand = np.arange(self.centroids.shape[0])
+
+            window = block[i].toarray().ravel() if sparse.issparse(block) else block[i]
+            sim = self.centroids[cand] @ window
+            best = np.argmax(sim)
+            nearest[i] = cand[best]
+            distances[i] = np.clip(1 - sim[best], 0, 2)
+
+        return distances, nearest
@@ -0,0 +1,108 @@
+"""
+Exact nearest centroid search in multiple processes sharing a single copy of the knowledge base
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import multiprocessing
+import tempfile
+import numpy as np
+from scipy import sparse
+
+from ..utils import Log
+from .BatchScoring import BatchScoring
+
+# Scoring of the worker process (attached to the shared centroids in `_attach`)
+_worker_scoring = None
+
+def _attach(path, offset, dtype, shape, block_size):
+    """ Map the shared centroids read-only in the worker process """
+    global _worker_scoring
+    centroids = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    _worker_scoring = BatchScoring(centroids, block_size, logging=False)
+
+def _query(X):
+    return _worker_scoring.query(X)
+
+class ParallelScoring(Log):
+    """ Split windows between worker processes, which score them against a shared knowledge base
+
+    ### Args:
+        centroids (np.ndarray): centroids of the knowledge base (one per row)
+        block_size (int): number of windows scored with a single matrix product
+        workers (int): number of worker processes
+        tmp_dir (str): (optional) directory for the shared centroids (default system temp directory)
+        logging (bool): enable logging
+
+    ### Notes:
+        Workers memory map the centroids read-only, so all of them share the same physical pages
+        and memory does not grow with the number of workers. Knowledge base imported with
+        `LogCluster.import_base` is mapped directly from its file, otherwise centroids are written
+        into a temporary file. The pool of workers is started on the first query and attached to
+        the centroids only once, later queries reuse it until `close` is called.
+    """
+
+    def __init__(self, centroids, block_size = 1024, workers = 2, tmp_dir = None, logging = True):
+        super().__init__(self.__class__.__name__, logging)
+        self.block_size = block_size
+        self.workers = workers
+        self.tmp_dir = tmp_dir
+        self.centroids = centroids
+
+        self._pool = None # Worker processes attached to the centroids (see `_attached_pool`)
+        self._file = None # Temporary file with centroids, which are not memory mapped from a file
+
+    def __getstate__(self):
+        # Worker processes are not copied (e.g with the model), the copy starts its own pool
+        return {**self.__dict__, "_pool": None, "_file": None}
+
+    def __del__(self):
+        self.close()
+
+    def query(self, X):
+        """ Find the nearest centroid for each window in X
+
+        ### Args:
+            X (np.ndarray | sparse.csr_matrix): windows to score (columns aligned with centroids, columns
+                beyond the centroids are events missing in the knowledge base and are zero in all centroids)
+
+        ### Returns:
+            distances (np.ndarray): cosine distance to the nearest centroid (NaN for zero windows)
+            nearest (np.ndarray): index of the nearest centroid (-1 for zero windows)
+        """
+        X = sparse.csr_matrix(X, dtype=np.float64) if sparse.issparse(X) else np.asarray(X, dtype=np.float64)
+        bounds = np.linspace(0, X.shape[0], self.workers + 1).astype(int)
+        chunks = [X[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+        self.log(f"Scoring {X.shape[0]} windows in {self.workers} processes")
+        results = self._attached_pool().map(_query, chunks)
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+    def close(self):
+        """ Stop the worker processes and remove the temporary file with centroids """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _attached_pool(self):
+        """ Pool of worker processes attached to the centroids (started on the first call) """
+        if self._pool is not None:
+            return self._pool
+
+        centroids = self.centroids
+        if isinstance(centroids, np.memmap) and centroids.filename is not None and centroids.flags.c_contiguous:
+            args = (centroids.filename, centroids.offset, centroids.dtype.str, centroids.shape)
+        else:
+            centroids = np.ascontiguousarray(centroids, dtype=np.float64)
+            self._file = tempfile.NamedTemporaryFile(dir=self.tmp_dir)
+            self._file.write(centroids.tobytes())
+            self._file.flush()
+            args = (self._file.name, 0, centroids.dtype.str, centroids.shape)
+
+        self._pool = multiprocessing.Pool(self.workers, initializer=_attach, initargs=args + (self.block_size,))
+        return self._pool
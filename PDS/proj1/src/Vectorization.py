@@ -0,0 +1,93 @@
+"""
+Vectorization of structured logs with the parameters of a configuration file (shared by log-monitor and scripts)
+
+Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
+Date: 4/2024
+"""
+
+import numpy as np
+import pandas as pd
+
+from .DataLoader import DataLoader
+from .FeatureExtraction import FeatureExtraction
+from .FeatureExtractionModels.TimeWindow import WindowParams
+
+def extraction_options(config):
+    """ Runtime options of feature extraction in the configuration (not stored in the knowledge base) """
+    if config is None:
+        return {}
+    options = {"workers": config.get("session_workers", 1)}
+    if "max_session_memory_mb" in config:
+        options["max_memory_mb"] = config["max_session_memory_mb"]
+    if "session_tmp_dir" in config:
+        options["tmp_dir"] = config["session_tmp_dir"]
+    if "time_cache_dir" in config:
+        options["cache_dir"] = config["time_cache_dir"]
+    return options
+
+def windowing_params(config):
+    """ Parameters of the configured windowing (see `FeatureExtraction.extraction_params`) """
+    if config["windowing"] == "session":
+        return {"session_reg": config["session_reg"], "session_col": config["session_col"]}
+    window_step = config["window_step"] if config["windowing"] == "sliding" else 60 * config["window_size"]
+    return {"wp": WindowParams(config["window_size"], window_step, config["time_col"], config["time_fmt"], config["date_col"], config["date_fmt"])}
+
+def load_lines(path, labels, config, columns, logging = True):
+    """ Load only the columns used by windowing, in chunks of `chunk_size` lines if configured
+
+    ### Args:
+        path (str): structured log file
+        labels (str): (optional) file with labels
+        config (dict): (optional) configuration
+        columns (tuple): used and categorical columns (see `FeatureExtraction.input_columns`)
+        logging (bool): enable logging
+
+    ### Returns:
+        x_data, y_data: log lines and labels, or chunks of (x_data, y_data) and None
+    """
+    usecols, categorical = columns
+    if config is not None and config.get("chunk_size") is not None:
+        return DataLoader(logging).load_csv_chunks(path, labels, chunk_size=config["chunk_size"], usecols=usecols, categorical=categorical), None
+    return DataLoader(logging).load_csv(path, labels, usecols=usecols, categorical=categorical)
+
+def normal_lines(x_data, y_data):
+    """ Keep only normal lines of the log (or of each chunk), labels are filtered together with the lines """
+    if isinstance(x_data, pd.DataFrame):
+        return (x_data, y_data) if y_data is None else (x_data[y_data == 0], y_data[y_data == 0])
+    return ((x, y) if y is None else (x[np.asarray(y) == 0], y[np.asarray(y) == 0]) for x, y in x_data), None
+
+def vectorize(config, data, labels, normal_only = True, logging = True):
+    """ Load the log and split it into weighted windows as configured
+
+    ### Args:
+        config (dict): configuration (see Readme)
+        data (str): structured log file
+        labels (str): (optional) file with labels
+        normal_only (bool): window only normal lines (training data of log-monitor)
+        logging (bool): enable logging
+
+    ### Returns:
+        feature_extraction (FeatureExtraction): trained feature extraction
+        X (DataFrame): weighted windows
+        Y (Array): labels of windows (None without labels)
+    """
+    feature_extraction = FeatureExtraction(event_col=config["event_col"], logging=logging, sparse=config.get("sparse", False),
+        hash_buckets=config.get("hash_buckets"), **extraction_options(config))
+    params = windowing_params(config)
+
+    x_data, y_data = load_lines(data, labels, config, feature_extraction.input_columns(params), logging)
+    if normal_only:
+        x_data, y_data = normal_lines(x_data, y_data)
+
+    # Apply windowing
+    if config["windowing"] == "session":
+        X, Y = feature_extraction.session_windowing(x_data, params["session_reg"], params["session_col"], y_data)
+    elif config["windowing"] == "sliding":
+        X, Y = feature_extraction.sliding_windowing(x_data, params["wp"], y_data)
+    elif config["windowing"] == "fixed":
+        X, Y = feature_extraction.fixed_windowing(x_data, params["wp"], y_data)
+
+    # Apply weighting
+    X = feature_extraction.apply_weighting(X, tf_idf=config["tf_idf"], contrast_w=config["contrast"])
+
+    return feature_extraction, X, Y
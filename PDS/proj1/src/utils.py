@@ -3,6 +3,10 @@ Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
 Date: 3/2024
 """
 
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
 class Log:
     """ Simple logging class for debugging purposes """
     def __init__(self, component: str, do_print: bool = True):
@@ -11,4 +15,66 @@ class Log:
         
     def log(self, message: str):
         if self.do_print:
-            print(f'{self.component}: {message}')
\ No newline at end of file
+            print(f'{self.component}: {message}')
+
+def normalize_rows(X, n_columns = None):
+    """ L2-normalize rows of the given matrix
+
+    ### Args:
+        X (np.ndarray): matrix with one vector per row
+        n_columns (int): (optional) keep only the first `n_columns` of the normalized rows (e.g columns of events,
+            which are zero in all centroids, only contribute to the length of the rows)
+
+    ### Returns:
+        X_norm (np.ndarray): matrix with unit length rows (zero rows are kept as zeros)
+        norms (np.ndarray): original length of each row
+    """
+    if sparse.issparse(X):
+        norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+        safe_norms = np.where(norms > 0, norms, 1)
+        X = X if n_columns is None else X[:, :n_columns]
+        return sparse.csr_matrix(X.multiply(1 / safe_norms[:, None])), norms
+    norms = np.linalg.norm(X, axis=1)
+    safe_norms = np.where(norms > 0, norms, 1)
+    X = X if n_columns is None else X[:, :n_columns]
+    return X / safe_norms[:, None], norms
+
+def is_sparse_frame(X):
+    """ Check whether all columns of the DataFrame are sparse (windows stored as a csr matrix) """
+    return isinstance(X, pd.DataFrame) and X.shape[1] > 0 and all(isinstance(dtype, pd.SparseDtype) for dtype in X.dtypes)
+
+def frame_values(X):
+    """ Values of the DataFrame, sparse frames are returned as a csr matrix (without densifying)
+
+    ### Args:
+        X (pd.DataFrame): windows (one per row)
+
+    ### Returns:
+        values (np.ndarray | sparse.csr_matrix): matrix with one window per row
+    """
+    if is_sparse_frame(X):
+        return X.sparse.to_coo().tocsr()
+    return X.values
+
+def sparse_frame(X, columns, index = None):
+    """ Create DataFrame with sparse columns from a sparse matrix """
+    return pd.DataFrame.sparse.from_spmatrix(sparse.csr_matrix(X, dtype=np.float64), index=index, columns=columns)
+
+def align_labels(x_data, y_data):
+    """ Labels of the log lines in x_data as an array
+
+    ### Args:
+        x_data (pd.DataFrame): log lines
+        y_data (Array): (optional) labels of the lines of x_data, or of the whole log when x_data
+            contains only some of its lines (e.g only normal lines), labels are then selected by the index of x_data
+
+    ### Returns:
+        labels (np.ndarray): label of each line of x_data in order of x_data (None without labels)
+    """
+    if y_data is None:
+        return None
+    if len(y_data) == len(x_data):
+        return np.asarray(y_data)
+    if isinstance(y_data, pd.Series):
+        return y_data.loc[x_data.index].to_numpy()
+    return np.asarray(y_data)[x_data.index.to_numpy()]
@@ -5,11 +5,21 @@ Author: Adam Zvara (xzvara01@stud.fit.vutbr.cz)
 Date: 4/2024
 """
 
+import pickle
 import unittest
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import cdist, pdist
+from scipy.cluster.hierarchy import linkage, fcluster
 
 from src.DataLoader import DataLoader
 from src.FeatureExtraction import FeatureExtraction
 from src.LogCluster import LogCluster
+from src.ClusteringModels.BlockedDistance import BlockedDistance
+from src.ClusteringModels.RadiusGraphClustering import RadiusGraphClustering
+from src.ClusteringModels.LeaderClustering import LeaderClustering
+from src.ScoringModels.ParallelScoring import ParallelScoring
+from src.ScoringModels.LSHScoring import LSHScoring
 
 import os
 base_path = os.path.dirname(os.path.abspath(__file__))
@@ -17,6 +27,13 @@ base_path = os.path.dirname(os.path.abspath(__file__))
 log_file = os.path.join(base_path, "dummy_data", "log_structured.csv")
 label_file = os.path.join(base_path, "dummy_data", "labels_structured.csv")
 
+def private_dirty_kb(pid):
+    """ Private memory of the process (pages not shared with other processes) in kB """
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            if line.startswith("Private_Dirty:"):
+                return int(line.split()[1])
+
 class ClusteringTest(unittest.TestCase):
     def setUp(self):
         x_raw, y_raw = DataLoader(False).load_csv(log_file, label_file)
@@ -49,7 +66,367 @@ class ClusteringTest(unittest.TestCase):
         # Import knowledge base
         model2 = LogCluster(0.3, 0.3, False, False)
         model2.import_base('test_model')
-        self.assertListEqual(model.centroids, model2.centroids)
+        np.testing.assert_allclose(model2.centroids, model.centroids, rtol=1e-6) # Centroids are stored in float32
+        self.assertIsInstance(model2.centroids, np.memmap)
+        self.assertListEqual(model2.events.tolist(), model.events.tolist())
         
         # Cleanup 
-        os.remove('test_model')
\ No newline at end of file
+        os.remove('test_model')
+        
+    def test_import_pickle_base(self):
+        model = LogCluster(0.3, 0.3, False, False)
+        model.fit(self.x.copy())
+        
+        # Knowledge base in the old pickle format
+        storage = {"centroids": model.centroids, "events": model.events, "dist": 0.3, "thr": 0.3, "contrast_w": False, "feature_extraction": self.fe}
+        with open('test_model.pkl', 'wb') as file:
+            pickle.dump(storage, file)
+        
+        # Pickled base is rejected by import_base, but can be converted
+        model2 = LogCluster(logging=False)
+        self.assertRaises(AssertionError, model2.import_base, 'test_model.pkl')
+        fe = model2.import_pickle_base('test_model.pkl')
+        model2.export_base('test_model', fe)
+        
+        model3 = LogCluster(logging=False)
+        fe3 = model3.import_base('test_model')
+        self.assertEqual(model3.threshold, 0.3)
+        self.assertEqual(fe3.events, self.fe.events)
+        self.assertEqual(fe3.extraction_params, self.fe.extraction_params)
+        
+        _, dist = model.predict(self.x)
+        _, dist3 = model3.predict(self.x)
+        np.testing.assert_allclose(dist3, dist, atol=1e-6)
+        
+        os.remove('test_model.pkl')
+        os.remove('test_model')
+        
+    def test_convert_legacy_pickle_base(self):
+        # Knowledge bases exported by log-monitor before the binary format (pickled objects of the old classes)
+        session_base = os.path.join(base_path, "dummy_data", "legacy_session_base.pkl")
+        fixed_base = os.path.join(base_path, "dummy_data", "legacy_fixed_base.pkl")
+        x_raw, y_raw = DataLoader(False).load_csv(log_file, label_file)
+        
+        model = LogCluster(logging=False)
+        fe = model.import_pickle_base(session_base)
+        model.export_base('test_model', fe)
+        self.assertEqual(fe.events, ["E5", "E6", "E9", "E11", "E16", "E22", "E26"])
+        self.assertIsNone(fe.extraction._pool)
+        
+        model2 = LogCluster(logging=False)
+        fe2 = model2.import_base('test_model')
+        x, y = fe2.transform(x_raw, y_raw)
+        x = fe2.apply_weighting(x, tf_idf=fe2.tf_idf, contrast_w=fe2.contrast_w)
+        y_pred, _ = model2.predict(x)
+        self.assertListEqual(y_pred.tolist(), y.tolist())
+        
+        model3 = LogCluster(logging=False)
+        fe3 = model3.import_pickle_base(fixed_base)
+        model3.export_base('test_model', fe3)
+        fe3 = model3.import_base('test_model')
+        self.assertEqual(fe3.extraction_params["wp"].window_size, 1)
+        x, y = fe3.transform(x_raw, y_raw)
+        self.assertEqual(x.shape, (232, 7))
+        
+        os.remove('test_model')
+        
+    def test_batch_predict_matches_pdist(self):
+        model = LogCluster(0.3, 0.3, False, False, block_size=2)
+        model.fit(self.x.copy())
+        
+        y_pred, distcs, nearest = model.predict(self.x, return_nearest=True)
+        
+        # Compare blocked scoring with distances computed directly by scipy
+        dist = cdist(self.x.values, np.array(model.centroids), metric='cosine')
+        np.testing.assert_allclose(distcs, dist.min(axis=1), atol=1e-9)
+        self.assertListEqual(nearest.tolist(), dist.argmin(axis=1).tolist())
+        self.assertListEqual(y_pred.tolist(), (dist.min(axis=1) > 0.3).tolist())
+        
+    def test_index_predict_matches_batch(self):
+        batch = LogCluster(0.3, 0.3, False, False)
+        batch.fit(self.x.copy())
+        index = LogCluster(0.3, 0.3, False, False, scoring="index")
+        index.fit(self.x.copy())
+        
+        # Add all-zero window, which has no candidates in the index
+        test = self.x.copy()
+        test.loc[len(test)] = 0
+        
+        _, dist_batch, near_batch = batch.predict(test, return_nearest=True)
+        _, dist_index, near_index = index.predict(test, return_nearest=True)
+        np.testing.assert_allclose(dist_index, dist_batch, atol=1e-9)
+        self.assertListEqual(near_index.tolist(), near_batch.tolist())
+        
+    def test_lsh_tables_exported(self):
+        model = LogCluster(0.3, 0.3, False, False, scoring="lsh", lsh_tables=4, lsh_bits=2)
+        model.fit(self.x.copy())
+        model.export_base('test_model', self.fe)
+        
+        # Imported model must reuse the stored hash tables
+        model2 = LogCluster(0.3, 0.3, False, False, scoring="lsh", lsh_tables=4, lsh_bits=2)
+        model2.import_base('test_model')
+        np.testing.assert_array_equal(model._lsh["codes"], model2._lsh["codes"])
+        
+        _, dist, _ = model.predict(self.x, return_nearest=True)
+        _, dist2, _ = model2.predict(self.x, return_nearest=True)
+        np.testing.assert_allclose(dist, dist2, atol=1e-6) # Centroids are stored in float32
+        
+        os.remove('test_model')
+        
+    def test_lsh_scoring_recall(self):
+        rng = np.random.default_rng(0)
+        columns = [f"E{i}" for i in range(20)]
+        train = pd.DataFrame(rng.random((200, 20)) * (rng.random((200, 20)) < 0.3), columns=columns)
+        test = pd.DataFrame(rng.random((100, 20)) * (rng.random((100, 20)) < 0.3), columns=columns)
+        model = LogCluster(0.05, 0.3, False, False, scoring="lsh", lsh_tables=1, lsh_bits=16)
+        model.fit(train)
+        
+        # Recall is the fraction of windows with the exact nearest distance, a single table of 16 bits misses some
+        batch = LogCluster(0.05, 0.3, False, False)
+        batch.fit(train)
+        _, exact = batch.predict(test)
+        _, approx = model.predict(test)
+        recall = model.scoring_recall(test)
+        self.assertEqual(recall, np.mean(np.isclose(approx, exact, rtol=0, atol=1e-9)))
+        self.assertLess(recall, 1)
+        
+        # With zero hyperplanes every window and centroid fall into the same bucket, so the search is exact
+        model._lsh = {"planes": np.zeros_like(model._lsh["planes"]), "codes": None}
+        model._build_scoring()
+        self.assertEqual(model.scoring_recall(test), 1)
+        
+    def test_lsh_new_events_independent_planes(self):
+        centroids = np.random.default_rng(0).random((20, 4))
+        scoring = LSHScoring(centroids, tables=2, bits=8, logging=False)
+        
+        # Stored hyperplanes are kept, components of new events are not a repetition of the stored ones
+        wider = LSHScoring(np.hstack([centroids, np.zeros((20, 4))]), tables=2, bits=8, planes=scoring.planes, logging=False)
+        np.testing.assert_array_equal(wider.planes[:, :, :4], scoring.planes)
+        self.assertFalse(np.isclose(wider.planes[:, :, 4:].ravel()[:, None], scoring.planes.ravel()[None, :]).any())
+        
+    def test_fit_duplicates_same_base(self):
+        model = LogCluster(0.3, 0.3, False, False)
+        model.fit(self.x.copy())
+        
+        # Repeating every window must not change the knowledge base
+        model2 = LogCluster(0.3, 0.3, False, False)
+        model2.fit(pd.concat([self.x] * 3, ignore_index=True))
+        self.assertListEqual(sorted(model.centroids.tolist()), sorted(model2.centroids.tolist()))
+        
+    def test_blocked_distance_matches_pdist(self):
+        X = self.x.values + 1e-8
+        expected = pdist(X, metric='cosine')
+        
+        # Both in memory and memory mapped distance matrix
+        for budget in [1, 1e-6]:
+            p_dist = BlockedDistance(budget, logging=False).pdist(X)
+            np.testing.assert_allclose(p_dist, expected, atol=1e-6)
+        
+        model = LogCluster(0.3, 0.3, False, False, max_fit_memory_mb=1e-6)
+        model.fit(self.x.copy())
+        self.assertEqual(len(model.centroids), 5)
+        
+    def test_radius_clustering_matches_linkage(self):
+        rng = np.random.default_rng(0)
+        X = rng.random((200, 7)) ** 4 * (rng.random((200, 7)) < 0.4) + 1e-8
+        
+        for max_dist in [0.05, 0.3, 0.6]:
+            expected = fcluster(linkage(pdist(X, metric='cosine'), 'complete'), max_dist, criterion='distance')
+            clusters = RadiusGraphClustering(max_dist, block_size=16, logging=False).fit_predict(X)
+            # Same partition of samples (cluster numbers may differ)
+            self.assertEqual(len(set(zip(expected, clusters))), len(set(expected)))
+            self.assertEqual(len(set(clusters)), len(set(expected)))
+        
+        model = LogCluster(0.3, 0.3, False, False, clustering="radius")
+        model.fit(self.x.copy())
+        self.assertEqual(len(model.centroids), 5)
+        
+    def test_leader_clustering(self):
+        model = LogCluster(0.3, 0.3, False, False, clustering="leader")
+        model.fit(self.x.copy())
+        
+        # Every training window must be within max_dist from the leader (first window) of its cluster
+        clusters = LeaderClustering(0.3, logging=False).fit_predict(self.x.values)
+        labels, leaders = np.unique(clusters, return_index=True)
+        leader_dist = cdist(self.x.values, self.x.values[leaders], metric='cosine')[np.arange(len(clusters)), np.searchsorted(labels, clusters)]
+        self.assertTrue(np.all(leader_dist <= 0.3 + 1e-12))
+        self.assertEqual(len(model.centroids), len(leaders))
+        
+        X = np.array([[1, 0], [1, 0.1], [0, 1], [1, 0.2]])
+        clusters = LeaderClustering(0.05, block_size=2, logging=False).fit_predict(X)
+        self.assertListEqual(clusters.tolist(), [1, 1, 2, 1])
+        
+    def test_partial_fit(self):
+        model = LogCluster(0.3, 0.3, False, False)
+        model.fit(self.x.iloc[:2].copy())
+        n_centroids = len(model.centroids)
+        
+        # Already known windows do not change the knowledge base
+        model.partial_fit(self.x.iloc[:2])
+        self.assertEqual(len(model.centroids), n_centroids)
+        
+        # New windows are either close to existing centroids or create new ones
+        model.partial_fit(self.x)
+        self.assertEqual(len(model.centroids), 5)
+        _, distcs = model.predict(self.x)
+        self.assertTrue(np.all(distcs <= 0.3))
+        
+    def test_compact(self):
+        model = LogCluster(0.01, 0.3, False, False)
+        model.fit(self.x.copy())
+        centroids = np.array(model.centroids)
+        
+        # Compaction with eps smaller than max_dist does not remove anything
+        self.assertEqual(model.compact(0.001), 0)
+        
+        # Every original centroid is within eps from the compacted knowledge base
+        removed = model.compact(0.5)
+        self.assertEqual(len(model.centroids), centroids.shape[0] - removed)
+        self.assertTrue(np.all(cdist(centroids, np.array(model.centroids), metric='cosine').min(axis=1) <= 0.5))
+        
+    def test_parallel_scoring_matches_batch(self):
+        model = LogCluster(0.3, 0.3, False, False)
+        model.fit(self.x.copy())
+        model.export_base('test_model', self.fe)
+        
+        # In-memory and imported (memory mapped) knowledge base
+        model2 = LogCluster(0.3, 0.3, False, False, workers=2)
+        model2.fit(self.x.copy())
+        model3 = LogCluster(logging=False, workers=2)
+        model3.import_base('test_model')
+        
+        _, dist, nearest = model.predict(self.x, return_nearest=True)
+        _, dist2, nearest2 = model2.predict(self.x, return_nearest=True)
+        _, dist3, nearest3 = model3.predict(self.x, return_nearest=True)
+        np.testing.assert_allclose(dist2, dist, atol=1e-9)
+        np.testing.assert_allclose(dist3, dist, atol=1e-6) # Centroids are stored in float32
+        self.assertListEqual(nearest2.tolist(), nearest.tolist())
+        self.assertListEqual(nearest3.tolist(), nearest.tolist())
+        
+        os.remove('test_model')
+        
+    @unittest.skipUnless(os.path.exists("/proc/self/smaps_rollup"), "requires Linux /proc")
+    def test_parallel_scoring_shared_memory(self):
+        rng = np.random.default_rng(0)
+        model = LogCluster(0.3, 0.3, logging=False)
+        model.centroids = rng.random((100000, 300), dtype=np.float32)
+        model.events = pd.Index([f"E{i}" for i in range(300)])
+        model.export_base('test_model', self.fe)
+        
+        # Windows with two events missing in the knowledge base (zero in all centroids)
+        X = pd.DataFrame(rng.random((64, 302)), columns=[f"E{i}" for i in range(302)])
+        sim = (X.values[:, :300] @ model.centroids.T) / np.linalg.norm(model.centroids, axis=1)
+        exact = 1 - sim.max(axis=1) / np.linalg.norm(X.values, axis=1)
+        
+        for workers in [2, 4]:
+            model2 = LogCluster(0.3, 0.3, logging=False, workers=workers)
+            model2.import_base('test_model')
+            _, dist = model2.predict(X)
+            scoring = model2._scoring
+            pool = scoring._pool
+            _, dist2 = model2.predict(X)
+            
+            # Workers are attached once, new events do not copy the memory mapped centroids
+            self.assertIsInstance(scoring, ParallelScoring)
+            self.assertIs(model2._scoring, scoring)
+            self.assertIs(scoring._pool, pool)
+            self.assertIsInstance(model2.centroids, np.memmap)
+            np.testing.assert_allclose(dist, exact, atol=1e-6)
+            np.testing.assert_array_equal(dist2, dist)
+            
+            # Workers map the same pages, so none of them holds a private copy of the knowledge base
+            for process in pool._pool:
+                self.assertLess(private_dirty_kb(process.pid), model2.centroids.nbytes / 1024 / 4)
+            scoring.close()
+        
+        os.remove('test_model')
+        
+    def test_sparse_fit_matches_dense(self):
+        x_raw, y_raw = DataLoader(False).load_csv(log_file, label_file)
+        fe = FeatureExtraction(event_col='EventId', logging=False, sparse=True)
+        x, _ = fe.session_windowing(x_raw, '(blk_-?\\d+)', 'Content', y_raw)
+        x = fe.apply_weighting(x, tf_idf=True, contrast_w=False)
+        
+        for clustering in ["hierarchical", "radius", "leader"]:
+            for scoring in ["batch", "index", "lsh"]:
+                dense = LogCluster(0.3, 0.3, False, False, clustering=clustering, scoring=scoring)
+                dense.fit(self.x.copy())
+                sparse = LogCluster(0.3, 0.3, False, False, clustering=clustering, scoring=scoring)
+                sparse.fit(x)
+                
+                # Both formats get the same noise in fit
+                np.testing.assert_allclose(sparse.centroids, dense.centroids, atol=1e-6)
+                y_dense, dist_dense = dense.predict(self.x)
+                y_sparse, dist_sparse = sparse.predict(x)
+                np.testing.assert_allclose(dist_sparse, dist_dense, atol=1e-6)
+                self.assertListEqual(y_sparse.tolist(), y_dense.tolist())
+        
+    def test_sparse_dense_same_clusters(self):
+        rng = np.random.default_rng(0)
+        X = rng.random((150, 12)) * (rng.random((150, 12)) < 0.3)
+        X[:5] = 0 # Empty windows get the same noise in both formats (other dense values get noise as well)
+        x_dense = pd.DataFrame(X, columns=[f"E{i}" for i in range(12)])
+        x_sparse = x_dense.astype(pd.SparseDtype("float64", 0))
+        
+        for clustering in ["hierarchical", "radius", "leader"]:
+            for budget in [None, 1e-3]:
+                for max_dist in [0.05, 0.3, 0.6]:
+                    dense = LogCluster(max_dist, 0.3, False, False, clustering=clustering, max_fit_memory_mb=budget)
+                    dense.fit(x_dense.copy())
+                    sparse = LogCluster(max_dist, 0.3, False, False, clustering=clustering, max_fit_memory_mb=budget)
+                    sparse.fit(x_sparse)
+                    # Noise can change the order of clusters, not the clusters (each centroid has its own match)
+                    dist = cdist(np.asarray(sparse.centroids), np.asarray(dense.centroids))
+                    self.assertListEqual(sorted(dist.argmin(axis=1).tolist()), list(range(len(dense.centroids))))
+                    self.assertLess(dist.min(axis=1).max(), 1e-6)
+        
+    def test_dense_noise_scores(self):
+        # Windows with only events of every window have near-zero negative tf-idf values,
+        # noise added to every dense value keeps their distances
+        counts = pd.DataFrame([[1, 2, 0], [2, 0, 1], [3, 0, 0], [1, 1, 1], [2, 0, 0], [1, 0, 3]], columns=["E1", "E2", "E3"])
+        x = FeatureExtraction('EventId', logging=False).apply_weighting(counts.astype(float), tf_idf=True)
+        
+        model = LogCluster(0.3, 0.3, False, False)
+        model.fit(x.copy())
+        y_pred, distcs = model.predict(x)
+        
+        # Scores of the previous version, which added the noise to every value in fit
+        np.testing.assert_allclose(distcs, [0, 0, 1, 0.0804419019, 1, 0], atol=1e-9)
+        self.assertListEqual(y_pred.tolist(), [0, 0, 1, 0, 1, 0])
+        
+    def test_new_events_keep_centroids(self):
+        for scoring in ["batch", "index", "lsh"]:
+            model = LogCluster(0.3, 0.3, False, False, scoring=scoring, lsh_tables=4, lsh_bits=4)
+            model.fit(self.x.iloc[:, 2:].copy())
+            centroids = model.centroids
+            
+            # Unseen events are zero in all centroids, centroids are not extended
+            _, distcs = model.predict(self.x)
+            self.assertIs(model.centroids, centroids)
+            self.assertListEqual(model.events.tolist(), self.x.columns[2:].tolist() + self.x.columns[:2].tolist())
+            padded = np.hstack([centroids, np.zeros((centroids.shape[0], 2))])
+            if scoring != "lsh":
+                dist = cdist(self.x[model.events].values, padded, metric='cosine')
+                np.testing.assert_allclose(distcs, dist.min(axis=1), atol=1e-9)
+            
+            # Exported knowledge base has a column for every event
+            model.export_base('test_model', self.fe)
+            model2 = LogCluster(0.3, 0.3, False, False, scoring=scoring)
+            model2.import_base('test_model')
+            np.testing.assert_allclose(model2.centroids, padded, atol=1e-6)
+            os.remove('test_model')
+        
+    def test_new_events_appended_to_centroids(self):
+        model = LogCluster(0.3, 0.3, True, False)
+        model.fit(self.x.iloc[:, 2:].copy())
+        centroids = np.array(model.centroids)
+        
+        # Unseen events get the next ids, centroids are extended with the default contrast weight
+        _, distcs = model.predict(self.x)
+        new_events = self.x.columns[:2].tolist()
+        self.assertListEqual(model.events.tolist(), self.x.columns[2:].tolist() + new_events)
+        np.testing.assert_array_equal(model.centroids[:, :-2], centroids)
+        np.testing.assert_array_equal(model.centroids[:, -2:], 0.25)
+        
+        dist = cdist(self.x[model.events].values, model.centroids, metric='cosine')
+        np.testing.assert_allclose(distcs, dist.min(axis=1), atol=1e-9)
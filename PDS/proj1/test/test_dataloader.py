@@ -51,6 +51,21 @@ class DataLoaderTest(unittest.TestCase):
         _, Y2 = dl.load_csv(log_file, label_file2)
         self.assertListEqual(Y.tolist(), Y2.tolist())
         
+    def test_load_csv_chunks(self):
+        dl = DataLoader(logging=False)
+        X, Y = dl.load_csv(log_file, label_file)
+        chunks = list(dl.load_csv_chunks(log_file, label_file, chunk_size=10, usecols=["EventId", "Content"], categorical=["EventId"]))
+        
+        # Chunks contain only the selected columns and together form the whole log
+        self.assertListEqual([x.shape[0] for x, _ in chunks], [10, 10, 10, 6])
+        self.assertListEqual(chunks[0][0].columns.tolist(), ["Content", "EventId"]) # Order of the file
+        self.assertEqual(chunks[0][0]["EventId"].dtype, "category")
+        self.assertListEqual(sum((x["EventId"].tolist() for x, _ in chunks), []), X["EventId"].tolist())
+        self.assertListEqual(sum((y.tolist() for _, y in chunks), []), Y.tolist())
+        
+        # Chunks without labels
+        self.assertTrue(all(y is None for _, y in dl.load_csv_chunks(log_file, chunk_size=10)))
+        
     def test_seqsplit_half_success(self):
         (x_train, y_train), (x_test, y_test) = self.fe.split_data(self.X, self.Y)
         
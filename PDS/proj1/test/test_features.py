@@ -6,6 +6,11 @@ Date: 3/2024
 """
 
 import unittest
+import zlib
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import sparse
 from scipy.special import expit
 from numpy import log
 
@@ -14,7 +19,9 @@ sys.path.append("..") # Adds higher directory to python modules path
 
 from src.DataLoader import DataLoader
 from src.FeatureExtraction import FeatureExtraction
-from src.FeatureExtractionModels.TimeWindow import WindowParams
+from src.EventVocabulary import EventVocabulary
+from src.FeatureExtractionModels.TimeWindow import WindowParams, TimeBasedExtraction, EventCountCube
+from src.FeatureExtractionModels.SessionWindow import SessionBasedExtraction, SessionTracker
 
 import os
 base_path = os.path.dirname(os.path.abspath(__file__))
@@ -97,6 +104,256 @@ class FeatureExtractorTest(unittest.TestCase):
         for first, second in zip(x_train.iloc[0].to_list(), exp_x):
             self.assertAlmostEqual(first, second, delta=0.0001)
     
+    def test_session_sparse_matches_dense(self):
+        (x_dense, _), (_, _)  = self._session_feature_extract(tf_idf_weighting=True)
+        
+        fe = FeatureExtraction('EventId', False, sparse=True)
+        x_sparse, _ = fe.session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+        x_sparse = fe.apply_weighting(x_sparse, True, False)
+        
+        # Windows are stored as sparse columns with the same values and column order
+        self.assertTrue(all(isinstance(dtype, pd.SparseDtype) for dtype in x_sparse.dtypes))
+        self.assertListEqual(x_sparse.columns.tolist(), x_dense.columns.tolist())
+        self.assertListEqual(x_sparse.sparse.to_dense().values.tolist(), x_dense.values.tolist())
+        
+        # Weighted windows keep the index of the windows in both formats
+        x_counts, _ = fe.session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+        weighted = fe.apply_weighting(x_counts.iloc[1:], True, False)
+        weighted_dense = fe.apply_weighting(x_counts.iloc[1:].sparse.to_dense(), True, False)
+        self.assertListEqual(weighted.index.tolist(), x_counts.index[1:].tolist())
+        self.assertListEqual(weighted.index.tolist(), weighted_dense.index.tolist())
+        
+        # Missing events are added as sparse columns as well
+        fe.events = fe.events + ["E100"]
+        x_test, _ = fe.transform(self.X1, self.Y1)
+        self.assertTrue(all(isinstance(dtype, pd.SparseDtype) for dtype in x_test.dtypes))
+        self.assertListEqual(x_test["E100"].sparse.to_dense().tolist(), x_test.shape[0] * [0])
+    
+    def test_count_events_codes(self):
+        fe = FeatureExtraction('EventId', False)
+        codes, vocabulary = fe._encode_events(pd.Series(["E10", "E2", "E10", "E7"]))
+        self.assertListEqual(vocabulary.tolist(), ["E2", "E7", "E10"])
+        self.assertListEqual(codes.tolist(), [2, 0, 2, 1])
+        
+        # Empty sequences are kept as zero rows, unused events are dropped
+        seq = pd.DataFrame({"EventId": [[2, 0, 2], [], [0]]})
+        X = fe._count_events_in_seq(seq, "EventId", vocabulary)
+        self.assertListEqual(X.columns.tolist(), ["E2", "E10"])
+        self.assertListEqual(X.values.tolist(), [[1, 2], [0, 0], [1, 0]])
+    
+    def test_windowing_keeps_lines(self):
+        # Event codes and parsed times are passed alongside the raw lines, the lines are not modified
+        lines = self.X1.copy()
+        wparams = WindowParams(window_size=60, window_step=60 * 60, time_col="Time", time_fmt="%H%M%S", date_col=["Date"], date_fmt="%d%m%y")
+        FeatureExtraction('EventId', False).fixed_windowing(self.X1, wparams, self.Y1)
+        FeatureExtraction('EventId', False).session_windowing(self.X1, r"(blk_-?\d+)", "Content", self.Y1)
+        pd.testing.assert_frame_equal(self.X1, lines)
+    
+    def test_event_vocabulary(self):
+        vocabulary = EventVocabulary(["E5", "E1"])
+        self.assertEqual(vocabulary.add(["E1", "E9", "E5", "E2"]), 2)
+        self.assertListEqual(vocabulary.events, ["E5", "E1", "E9", "E2"]) # Ids of known events do not change
+        self.assertListEqual(vocabulary.indexer(["E2", "E7", "E5"]).tolist(), [3, -1, 0])
+        
+        # Columns are moved to their ids, unknown events are dropped
+        X = pd.DataFrame([[1, 2, 3], [4, 5, 6]], columns=["E1", "E7", "E2"])
+        aligned = vocabulary.align(X)
+        self.assertListEqual(aligned.columns.tolist(), vocabulary.events)
+        self.assertListEqual(aligned.values.tolist(), [[0, 1, 0, 3], [0, 4, 0, 6]])
+        
+        X_sparse = X.astype(pd.SparseDtype("float64", 0))
+        self.assertListEqual(vocabulary.align(X_sparse).sparse.to_dense().values.tolist(), aligned.values.tolist())
+        
+        # Index of events is cached until new events are added
+        index = vocabulary.index
+        self.assertIs(vocabulary.index, index)
+        vocabulary.add(["E3"])
+        self.assertListEqual(vocabulary.index.tolist(), ["E5", "E1", "E9", "E2", "E3"])
+    
+    def test_transform_missing_events_order(self):
+        fe = FeatureExtraction('EventId', False)
+        X, _ = fe.session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+        self.assertIs(fe.events, fe.events)
+        
+        # Lines without the first and the last event, missing training events keep their columns
+        lines = self.X1[~self.X1["EventId"].isin([X.columns[0], X.columns[-1]])]
+        x_test, _ = fe.transform(lines, self.Y1)
+        self.assertListEqual(x_test.columns.tolist(), X.columns.tolist())
+        self.assertListEqual(x_test.iloc[:, [0, -1]].values.sum(axis=0).tolist(), [0, 0])
+    
+    def test_session_hashing(self):
+        x_exact, _ = FeatureExtraction('EventId', False).session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+        
+        fe = FeatureExtraction('EventId', False, hash_buckets=16)
+        x_hashed, _ = fe.session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+        
+        # Every bucket is a column, counts of events in the same bucket are summed
+        buckets = [f"H{zlib.crc32(event.encode('utf-8')) % 16}" for event in x_exact.columns]
+        exp_x = x_exact.T.groupby(buckets).sum().T.reindex(columns=x_hashed.columns, fill_value=0)
+        self.assertListEqual(x_hashed.columns.tolist(), [f"H{i}" for i in range(16)])
+        self.assertListEqual(x_hashed.values.tolist(), exp_x.values.tolist())
+        self.assertListEqual(fe.events, sorted(set(buckets), key=lambda x: int(x[1:]))) # Only non-empty buckets
+        
+        # Unknown events do not change the width of the windows
+        X = self.X1.copy()
+        X.loc[:10, "EventId"] = "E1000"
+        x_test, _ = fe.transform(X, self.Y1)
+        self.assertListEqual(x_test.columns.tolist(), x_hashed.columns.tolist())
+        self.assertEqual(FeatureExtraction.from_params(fe.get_params(), False).hash_buckets, 16)
+    
+    def test_session_ids_extraction(self):
+        x = pd.DataFrame({"Content": ["a blk_2 blk_1 blk_2", "b", "c blk_1", "d blk_3"], "EventId": [5, 6, 7, 8]})
+        X, Y = SessionBasedExtraction(False).transform(x, "EventId", r"blk_\d+", "Content", pd.Series([0, 0, 0, 1]))
+        
+        # Sessions are ordered by first appearance, message with a repeated id is counted once
+        self.assertListEqual(X["SessionId"].tolist(), ["blk_2", "blk_1", "blk_3"])
+        self.assertListEqual([list(events) for events in X["EventId"]], [[5], [5, 7], [8]])
+        self.assertListEqual(Y.tolist(), [0, 0, 1])
+    
+    def test_session_parallel_matches_serial(self):
+        X, Y = SessionBasedExtraction(False).transform(self.X1, "EventId", r"(blk_-?\d+)", "Content", self.Y1)
+        extraction = SessionBasedExtraction(False, workers=3)
+        X_par, Y_par = extraction.transform(self.X1, "EventId", r"(blk_-?\d+)", "Content", self.Y1)
+        
+        self.assertListEqual(X_par["SessionId"].tolist(), X["SessionId"].tolist())
+        self.assertListEqual([list(events) for events in X_par["EventId"]], [list(events) for events in X["EventId"]])
+        self.assertListEqual(Y_par.tolist(), Y.tolist())
+        
+        # Next transform reuses the worker processes
+        pool = extraction._pool
+        X_next, _ = extraction.transform(self.X1, "EventId", r"(blk_-?\d+)", "Content", self.Y1)
+        self.assertIsNotNone(pool)
+        self.assertIs(extraction._pool, pool)
+        self.assertListEqual(X_next["SessionId"].tolist(), X["SessionId"].tolist())
+        extraction.close()
+        self.assertIsNone(extraction._pool)
+    
+    def test_session_spill_matches_memory(self):
+        x_memory, y_memory = FeatureExtraction('EventId', False).session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+        
+        # Budget of 20 lines per chunk splits the dummy data into several chunks and partitions
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fe = FeatureExtraction('EventId', False, max_memory_mb=20 * 256 / 2**20, tmp_dir=tmp_dir)
+            x_spill, y_spill = fe.session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+            self.assertListEqual(os.listdir(tmp_dir), []) # Spill files are removed
+            
+            self.assertListEqual(x_spill.columns.tolist(), x_memory.columns.tolist())
+            self.assertListEqual(x_spill.values.tolist(), x_memory.values.tolist())
+            self.assertListEqual(y_spill.tolist(), y_memory.tolist())
+            
+            # Session ids of test data are in the same order
+            fe.transform(self.X1, self.Y1)
+            fe_memory = FeatureExtraction.from_params(fe.get_params(), False)
+            fe_memory.transform(self.X1, self.Y1)
+            self.assertListEqual(fe.session_ids, fe_memory.session_ids)
+            
+            self.Y1[0] = 1
+            with self.assertRaises(AssertionError):
+                fe.session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+    
+    def test_session_chunks_match_memory(self):
+        x_memory, y_memory = FeatureExtraction('EventId', False).session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+        
+        # Spill files larger than the chunk (or a budget of 3 lines) are split again
+        for max_memory_mb in [None, 3 * 256 / 2**20]:
+            fe = FeatureExtraction('EventId', False, max_memory_mb=max_memory_mb)
+            chunks = self.dl.load_csv_chunks(log_file, label_file, chunk_size=7, usecols=["EventId", "Content"], categorical=["EventId"])
+            x_chunks, y_chunks = fe.session_windowing(chunks, r'(blk_-?\d+)', 'Content')
+            self.assertListEqual(x_chunks.columns.tolist(), x_memory.columns.tolist())
+            self.assertListEqual(x_chunks.values.tolist(), x_memory.values.tolist())
+            self.assertListEqual(y_chunks.tolist(), y_memory.tolist())
+            
+            fe.transform(self.X1, self.Y1)
+            session_ids = fe.session_ids
+            fe.transform(self.dl.load_csv_chunks(log_file, chunk_size=5))
+            self.assertListEqual(fe.session_ids, session_ids)
+    
+    def test_session_tracker(self):
+        x = pd.DataFrame({"Content": ["blk_1", "blk_2", "blk_1", "blk_3", "blk_3", "blk_3", "blk_1"], "EventId": ["E1", "E2", "E3", "E4", "E5", "E6", "E7"]})
+        
+        # blk_1 is inactive for 4 lines (timeout is 3), so its last line starts a new session
+        tracker = SessionTracker("EventId", r"(blk_-?\d+)", "Content", timeout=3)
+        X1, _ = tracker.update(x.iloc[:4])
+        X2, _ = tracker.update(x.iloc[4:])
+        X3, _ = tracker.flush()
+        self.assertListEqual(X1["SessionId"].tolist(), [])
+        self.assertListEqual(X2["SessionId"].tolist(), ["blk_2", "blk_1"])
+        self.assertListEqual([list(events) for events in X2["EventId"]], [["E2"], ["E1", "E3"]])
+        self.assertListEqual(X3["SessionId"].tolist(), ["blk_3", "blk_1"])
+        self.assertListEqual([list(events) for events in X3["EventId"]], [["E4", "E5", "E6"], ["E7"]])
+        
+        # Gaps within a single chunk split the sessions in the same way
+        tracker = SessionTracker("EventId", r"(blk_-?\d+)", "Content", timeout=3)
+        X, _ = tracker.update(x)
+        X = pd.concat([X, tracker.flush()[0]])
+        self.assertListEqual(X["SessionId"].tolist(), ["blk_2", "blk_1", "blk_3", "blk_1"])
+        
+        # Least recently seen sessions are closed when there are too many open sessions
+        tracker = SessionTracker("EventId", r"(blk_-?\d+)", "Content", timeout=100, max_open_sessions=1)
+        X1, _ = tracker.update(x.iloc[:4])
+        self.assertListEqual(X1["SessionId"].tolist(), ["blk_2", "blk_1"])
+        self.assertEqual(len(tracker.sessions), 1)
+        
+    def test_session_tracker_without_ids(self):
+        # Chunk without any session id still advances the position and closes inactive sessions
+        tracker = SessionTracker("EventId", r"(blk_-?\d+)", "Content", timeout=3)
+        X1, Y1 = tracker.update(pd.DataFrame({"Content": ["blk_1"], "EventId": ["E1"]}), [0])
+        X2, Y2 = tracker.update(pd.DataFrame({"Content": ["foo", "bar"], "EventId": ["E2", "E3"]}), [0, 0])
+        X3, Y3 = tracker.update(pd.DataFrame({"Content": ["foo", "bar"], "EventId": ["E2", "E3"]}), [0, 0])
+        self.assertListEqual(X1["SessionId"].tolist() + X2["SessionId"].tolist(), [])
+        self.assertListEqual(X3["SessionId"].tolist(), ["blk_1"])
+        self.assertListEqual(Y3.tolist(), [0])
+        
+        # Stream of chunks without session ids produces no windows
+        fe = FeatureExtraction('EventId', False)
+        fe.session_windowing(self.X1, r'(blk_-?\d+)', 'Content', self.Y1)
+        chunks = [pd.DataFrame({"Content": ["foo"], "EventId": ["E2"]})] * 3
+        self.assertListEqual(list(fe.session_stream(chunks, timeout=1)), [])
+        
+    def test_session_tracker_times(self):
+        x = pd.DataFrame({"Content": ["blk_1", "blk_2", "blk_1", "blk_2", "blk_1"], "EventId": ["E1", "E2", "E3", "E4", "E5"]})
+        
+        # Timeout is in seconds of the timestamps, blk_2 is inactive for 25 seconds and blk_1 for 18 seconds
+        tracker = SessionTracker("EventId", r"(blk_-?\d+)", "Content", timeout=20)
+        X1, _ = tracker.update(x.iloc[:3], times=[0, 0, 10])
+        X2, _ = tracker.update(x.iloc[3:], times=[25, 28])
+        X3, _ = tracker.flush()
+        self.assertListEqual(X1["SessionId"].tolist(), [])
+        self.assertListEqual(X2["SessionId"].tolist(), ["blk_2"])
+        self.assertListEqual([list(events) for events in X2["EventId"]], [["E2"]])
+        self.assertListEqual(X3["SessionId"].tolist(), ["blk_2", "blk_1"])
+        self.assertListEqual([list(events) for events in X3["EventId"]], [["E4"], ["E1", "E3", "E5"]])
+    
+    def test_session_stream_matches_transform(self):
+        self._session_feature_extract(tf_idf_weighting=False)
+        x_test, y_test = self.fe.transform(self.X1, self.Y1)
+        expected = {session: (row, label) for session, row, label in zip(self.fe.session_ids, x_test.values.tolist(), y_test)}
+        
+        # Without timeout sessions are emitted at the end, in order of their last appearance
+        chunks = [(self.X1.iloc[start:start + 5], self.Y1.iloc[start:start + 5], None) for start in range(0, len(self.X1), 5)]
+        streamed = {}
+        for X, Y in self.fe.session_stream(chunks, timeout=len(self.X1)):
+            self.assertListEqual(X.columns.tolist(), x_test.columns.tolist())
+            streamed.update({session: (row, label) for session, row, label in zip(self.fe.session_ids, X.values.tolist(), Y)})
+        self.assertDictEqual(streamed, expected)
+    
+    def test_filtered_lines_full_labels(self):
+        # Labels of the whole log are selected by the index of the filtered lines (log-monitor trains on normal lines)
+        normal = (self.Y1 == 0).to_numpy()
+        wparams = WindowParams(window_size=60, window_step=60 * 30, time_col="Time", time_fmt="%H%M%S")
+        for fe in [FeatureExtraction('EventId', False), FeatureExtraction('EventId', False, max_memory_mb=20 * 256 / 2**20)]:
+            X, Y = fe.session_windowing(self.X1[normal], r'(blk_-?\d+)', 'Content', self.Y1)
+            X_exp, Y_exp = fe.session_windowing(self.X1[normal], r'(blk_-?\d+)', 'Content', self.Y1[normal])
+            self.assertListEqual(X.values.tolist(), X_exp.values.tolist())
+            self.assertListEqual(Y.tolist(), Y_exp.tolist())
+            self.assertListEqual(Y.tolist(), [0] * len(Y))
+        
+        for labels in [self.Y1, self.Y1.to_numpy()]:
+            X, Y = FeatureExtraction('EventId', False).sliding_windowing(self.X1[normal].copy(), wparams, labels)
+            X_exp, Y_exp = FeatureExtraction('EventId', False).sliding_windowing(self.X1[normal].copy(), wparams, self.Y1[normal])
+            self.assertListEqual(X.values.tolist(), X_exp.values.tolist())
+            self.assertListEqual(Y.tolist(), [0] * len(Y))
+        
     def test_session_different_labels_fail(self):
         self.Y1[0] = 1 # First sessionId has different label than the rest
         with self.assertRaises(AssertionError):
@@ -129,6 +386,100 @@ class FeatureExtractorTest(unittest.TestCase):
             for first, second in zip(line[1].to_list(), exp_weighted.pop(0)):
                 self.assertAlmostEqual(first, second, delta=0.0001)
         
+    def test_fixed_unsorted_lines(self):
+        (x, y), (_, _) = self._fixed_feature_extract(date=None, date_fmts=None)
+        
+        # Lines do not have to be sorted by time, windows are the same
+        order = list(reversed(range(len(self.X1))))
+        self.X1 = self.X1.iloc[order].reset_index(drop=True)
+        self.Y1 = self.Y1.iloc[order].reset_index(drop=True)
+        (x_unsorted, y_unsorted), (_, _) = self._fixed_feature_extract(date=None, date_fmts=None)
+        self.assertListEqual(x_unsorted.values.tolist(), x.values.tolist())
+        self.assertListEqual(y_unsorted.tolist(), y.tolist())
+        
+    def test_window_sweep_expected_windows(self):
+        fe = FeatureExtraction('EventId', False)
+        wp = WindowParams(window_size=0, window_step=0, time_col="Time", time_fmt="%H%M%S")
+        windows = [(60, 60 * 30), (60, 60 * 60), (5, 60)]
+        (wp_30, X_30, Y_30), (wp_60, X_60, Y_60), (wp_5, X_5, Y_5) = fe.window_sweep(self.X1, wp, windows, self.Y1)
+        self.assertListEqual([(p.window_size, p.window_step) for p in [wp_30, wp_60, wp_5]], windows)
+        
+        # Events counted in [start, start + size) of windows starting at the first time of the log
+        exp_30 = [[3, 0, 0, 2, 0, 1, 0], [0, 0, 3, 2, 0, 0, 2], [0, 0, 4, 2, 0, 0, 3], [1, 0, 4, 5, 1, 0, 2],
+                  [1, 0, 4, 4, 2, 0, 1], [1, 0, 2, 1, 1, 0, 0], [1, 6, 1, 1, 0, 0, 0], [0, 6, 0, 0, 0, 0, 0]]
+        self.assertListEqual(X_30.columns.tolist(), ['E5', 'E6', 'E9', 'E11', 'E16', 'E22', 'E26'])
+        self.assertListEqual(X_30.values.tolist(), exp_30)
+        self.assertListEqual(Y_30.tolist(), [1] * 8)
+        self.assertListEqual(X_60.values.tolist(), exp_30[::2])
+        self.assertListEqual(Y_60.tolist(), [1] * 4)
+        
+        # Short windows every minute, most of them are empty
+        self.assertEqual(X_5.shape, (232, 7))
+        self.assertListEqual(X_5.values.sum(axis=0).tolist(), [21, 30, 45, 45, 10, 5, 20])
+        self.assertListEqual(X_5.iloc[[0, 4, 66, 69, 131, 181]].values.tolist(), [[1, 0, 0, 0, 0, 0, 0], [1, 0, 0, 0, 0, 1, 0],
+            [0, 0, 2, 1, 0, 0, 0], [0, 0, 2, 1, 0, 0, 1], [1, 0, 1, 2, 1, 0, 0], [1, 0, 1, 1, 0, 0, 0]])
+        self.assertListEqual(Y_5.nonzero()[0].tolist(), [4, 5, 6, 7, 8, 10, 11, 12, 13, 14, 27, 28, 29, 30, 31, 69, 70, 71, 72, 73,
+            131, 132, 133, 134, 135, 141, 142, 143, 144, 145, 177, 178, 179, 180, 181, 211, 212, 213, 214, 215])
+        
+    def test_count_cube_checkpoints(self):
+        rng = np.random.default_rng(0)
+        times = rng.integers(0, 300, 2000) * 10**9
+        codes = rng.integers(0, 5, 2000)
+        counts = sparse.csr_matrix((np.ones(2000, dtype=np.int32), (np.arange(2000), codes)), shape=(2000, 5))
+        
+        # Cumulative counts of lines before each unique timestamp, computed directly
+        unique_times = np.unique(times)
+        expected = np.array([np.bincount(codes[times < t], minlength=5) for t in np.r_[unique_times, unique_times[-1] + 1]])
+        
+        for checkpoint_rows in [1, 7, 64, 1000]:
+            cube = type("Cube", (EventCountCube,), {"_checkpoint_rows": checkpoint_rows})(times, counts)
+            self.assertEqual(cube.checkpoints.shape, (len(unique_times) // checkpoint_rows + 1, 5))
+            self.assertEqual(cube.dtype, np.int32)
+            self.assertListEqual(cube.cumulative(np.arange(len(unique_times) + 1)).tolist(), expected.tolist())
+        
+        # Counts of more than 2^31 - 1 lines do not overflow
+        large = sparse.csr_matrix(np.array([[2**31 - 1, 0], [0, 1], [2**31 - 1, 1]], dtype=np.int64))
+        cube = EventCountCube(np.array([0, 1, 2]), large)
+        self.assertEqual(cube.dtype, np.int64)
+        self.assertListEqual(cube.cumulative([3]).tolist(), [[2**32 - 2, 2]])
+        
+    def test_fixed_datetime_cache(self):
+        wparams = WindowParams(window_size=60, window_step=60 * 60, time_col="Time", time_fmt="%H%M%S", date_col=["Date"], date_fmt="%d%m%y")
+        X, Y = FeatureExtraction('EventId', False).fixed_windowing(self.X1, wparams, self.Y1)
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            fe = FeatureExtraction('EventId', False, cache_dir=cache_dir)
+            fe.fixed_windowing(self.X1, wparams, self.Y1)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            
+            # Second run uses the parsed values from the cache
+            fe.extraction._parse_datetimes = None
+            X_cached, Y_cached = fe.transform(self.X1, self.Y1)
+            self.assertListEqual(X_cached.values.tolist(), X.values.tolist())
+            self.assertListEqual(Y_cached.tolist(), Y.tolist())
+        
+    def test_time_windows_labels(self):
+        (_, y), (_, _) = self._sliding_feature_extract(date=None, date_fmts=None)
+        
+        # Lists of events of windows are labeled in the same way as the counted windows, without rows of windows
+        wparams = WindowParams(window_size=60, window_step=60 * 30, time_col="Time", time_fmt="%H%M%S")
+        X, Y = TimeBasedExtraction(False).transform(self.X1.copy(), "EventId", wparams, self.Y1)
+        self.assertListEqual(X.columns.tolist(), ["Time", "EventId"])
+        self.assertListEqual(Y.tolist(), y.tolist())
+        
+    def test_sliding_chunks_match_memory(self):
+        # Dates change inside of chunks and the lines of a date are split into several chunks
+        self.X1.loc[self.X1["Id"] > 10, "Date"] = 91109
+        wparams = WindowParams(window_size=60, window_step=60 * 30, time_col="Time", time_fmt="%H%M%S", date_col=["Date"], date_fmt="%d%m%y")
+        x_memory, y_memory = FeatureExtraction('EventId', False).sliding_windowing(self.X1.copy(), wparams, self.Y1)
+        
+        fe = FeatureExtraction('EventId', False)
+        chunks = [(self.X1.iloc[start:start + 7], self.Y1[start:start + 7]) for start in range(0, len(self.X1), 7)]
+        x_chunks, y_chunks = fe.sliding_windowing(chunks, wparams)
+        self.assertListEqual(x_chunks.columns.tolist(), x_memory.columns.tolist())
+        self.assertListEqual(x_chunks.values.tolist(), x_memory.values.tolist())
+        self.assertListEqual(y_chunks.tolist(), y_memory.tolist())
+        
     def test_fixed_date_single_col_success(self):
         # Change the date and time for couple events
         self.X1.loc[self.X1["Id"] > 10, "Date"] = 91109